@@ -12,16 +12,17 @@ import hashlib
 import cv2
 import json
 import shutil
+import stat
+import errno
+import mmap
 import re
 import sqlite3
 import time
 from datetime import datetime
-import glob
 import sys
 import subprocess
 import base64
 import zipfile
-import io
 from flask import Flask, render_template, send_from_directory, abort, send_file, url_for, redirect, request, jsonify, Response, session
 from PIL import Image, ImageSequence
 import colorsys
@@ -29,6 +30,7 @@ from werkzeug.utils import secure_filename
 import concurrent.futures
 from tqdm import tqdm
 import threading
+import atexit
 import uuid
 import socket
 # Try to import tkinter for GUI dialogs, but make it optional for Docker/headless environments
@@ -42,16 +44,36 @@ except ImportError:
 TKINTER_AVAILABLE = False # forcing to false for cross-platform compatibility 
 import secrets
 from typing import Dict, List, Any, Optional, Union
-from functools import wraps
+from functools import wraps, lru_cache
+from contextlib import contextmanager
 from cryptography.fernet import Fernet
 import urllib.request 
-import secrets
-from typing import Dict, List, Any, Optional, Union # Added for type hinting in new tools
 try:
     from waitress import serve
     WAITRESS_AVAILABLE = True
 except ImportError:
     WAITRESS_AVAILABLE = False
+# Optional: orjson is a much faster drop-in for JSON encoding/decoding (falls back to stdlib json)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+# The pluggable JSON provider only exists in Flask >= 2.2; without it jsonify() stays on stdlib json
+try:
+    from flask.json.provider import DefaultJSONProvider
+    JSON_PROVIDER_AVAILABLE = True
+except ImportError:
+    JSON_PROVIDER_AVAILABLE = False
+
+def fast_json_loads(data):
+    """json.loads via orjson when available. Falls back to stdlib for what orjson rejects (NaN, >64-bit ints)."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
 
 
 # ============================================================================
@@ -392,8 +414,13 @@ ENCRYPTION_KEY_FILE = os.path.join(SQLITE_CACHE_DIR, 'system.key')
 ZIP_CACHE_DIR = os.path.join(BASE_SMARTGALLERY_PATH, ZIP_CACHE_FOLDER_NAME)
 IMPORTED_WORKFLOWS_FOLDER_NAME = '.imported_workflows'
 IMPORTED_WORKFLOWS_DIR = os.path.join(BASE_SMARTGALLERY_PATH, IMPORTED_WORKFLOWS_FOLDER_NAME)
+# Resolved once: used for path-traversal checks on every input-file lookup
+BASE_INPUT_PATH_ABS = os.path.abspath(BASE_INPUT_PATH)
+BASE_INPUT_PATH_ABS_PREFIX = os.path.join(BASE_INPUT_PATH_ABS, '')
 PROTECTED_FOLDER_KEYS = {path_to_key(f) for f in SPECIAL_FOLDERS}
 PROTECTED_FOLDER_KEYS.add('_root_')
+# Roles with full (back-office) access
+PRIVILEGED_ROLES = frozenset(('ADMIN', 'MANAGER', 'STAFF'))
 
 
 # --- CONSOLE STYLING ---
@@ -443,18 +470,16 @@ def run_integrity_check():
     
     mismatches = []
     for f_path in critical_files:
-        if not os.path.exists(f_path):
-            print(f"\n{Colors.RED}❌ CRITICAL FILE MISSING: {f_path}{Colors.RESET}")
-            issues_found = True
-            critical_error = True
-            continue
-        
         try:
             with open(f_path, 'r', encoding='utf-8') as f:
                 header = "".join([f.readline() for _ in range(15)])
                 if APP_VERSION not in header:
                     mismatches.append(f_path)
                     issues_found = True
+        except FileNotFoundError:
+            print(f"\n{Colors.RED}❌ CRITICAL FILE MISSING: {f_path}{Colors.RESET}")
+            issues_found = True
+            critical_error = True
         except Exception: 
             pass
 
@@ -514,6 +539,52 @@ def normalize_smart_path(path_str):
     if not path_str: return ""
     return str(path_str).lower().replace('\\', '/')
 
+def safe_path_norm(p):
+    """
+    Case-folded, forward-slash, normpath'd form used to decide which folder view a file
+    belongs to (gallery view and its filter options must agree).
+    """
+    if not p: return ""
+    return os.path.normpath(str(p).replace('\\', '/')).replace('\\', '/').lower().rstrip('/')
+
+def make_folder_scope_matcher(folder_path, recursive):
+    """
+    Returns match(path) -> bool: True if the file is directly inside folder_path, or anywhere
+    below it when recursive, compared with safe_path_norm().
+    Results are memoized per directory for the lifetime of the matcher (one request).
+    """
+    target_norm = safe_path_norm(folder_path)
+    target_prefix = target_norm + '/'
+    dir_matches = {}
+
+    def match(path):
+        dir_key = path[:max(path.rfind('/'), path.rfind('\\')) + 1]
+        is_match = dir_matches.get(dir_key)
+        if is_match is None:
+            f_path_norm = safe_path_norm(path)
+            if recursive:
+                # Inside the target folder tree
+                is_match = f_path_norm.startswith(target_prefix)
+            else:
+                # Strict local: must be in this exact folder
+                is_match = safe_path_norm(os.path.dirname(f_path_norm)) == target_norm
+            dir_matches[dir_key] = is_match
+        return is_match
+
+    return match
+
+def get_ext_lower(path):
+    """
+    Same result as os.path.splitext(path)[1].lower().
+    """
+    dot = path.rfind('.')
+    if dot <= 0: return ""
+    sep = path.rfind(os.sep)
+    if os.altsep: sep = max(sep, path.rfind(os.altsep))
+    # splitext ignores leading dots of the basename (".bashrc" has no extension)
+    if dot <= sep + 1 or not path[sep + 1:dot].strip('.'): return ""
+    return path[dot:].lower()
+
 def print_configuration():
     """Prints the current configuration in a neat, aligned table."""
     print(f"\n{Colors.HEADER}{Colors.BOLD}--- CURRENT CONFIGURATION ---{Colors.RESET}")
@@ -587,7 +658,38 @@ def management_api_only(f):
     return decorated_function
 
 # --- FLASK APP INITIALIZATION ---
+if ORJSON_AVAILABLE and JSON_PROVIDER_AVAILABLE:
+    class OrjsonProvider(DefaultJSONProvider):
+        """Flask JSON provider backed by orjson, with stdlib fallback for unusual kwargs/values."""
+        def dumps(self, obj, **kwargs):
+            # response() always passes either compact separators (orjson's native output)
+            # or indent=2 in debug mode (OPT_INDENT_2); anything else goes to stdlib json.
+            # Keys are sorted like the stdlib provider: the sidebar compares key order of
+            # the page-embedded folder config (tojson) with the JSON API's.
+            orjson_kwargs = dict(kwargs)
+            option = orjson.OPT_NON_STR_KEYS
+            if orjson_kwargs.pop('sort_keys', self.sort_keys):
+                option |= orjson.OPT_SORT_KEYS
+            if orjson_kwargs.get('separators') == (',', ':'):
+                del orjson_kwargs['separators']
+            if orjson_kwargs.get('indent') == 2:
+                del orjson_kwargs['indent']
+                option |= orjson.OPT_INDENT_2
+            if orjson_kwargs:
+                return super().dumps(obj, **kwargs)
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+            except (orjson.JSONEncodeError, TypeError):
+                return super().dumps(obj, **kwargs)
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return orjson.loads(s)
+
 app = Flask(__name__)
+if ORJSON_AVAILABLE and JSON_PROVIDER_AVAILABLE:
+    app.json = OrjsonProvider(app)
 app.secret_key = SECRET_KEY
 gallery_view_cache = []
 folder_config_cache = None
@@ -596,6 +698,8 @@ FFPROBE_EXECUTABLE_PATH = None
 
 # Data structures for node categorization and analysis
 NODE_CATEGORIES_ORDER = ["input", "model", "processing", "output", "others"]
+# Sort rank per category
+NODE_CATEGORY_RANK = {category: i for i, category in enumerate(NODE_CATEGORIES_ORDER)}
 NODE_CATEGORIES = {
     "Load Checkpoint": "input", "CheckpointLoaderSimple": "input", "Empty Latent Image": "input",
     "CLIPTextEncode": "input", "Load Image": "input",
@@ -627,38 +731,45 @@ NODE_PARAM_NAMES = {
     "VantageProject": ["project", "positive_text", "param2", "filename", "param4", "hash"]
 }
 
-# Cache for node colors
-_node_colors_cache = {}
+# Hex color for each 0-359 hue bucket
+_NODE_HUE_LUT = tuple(
+    "#{:02x}{:02x}{:02x}".format(*(int(c * 255) for c in colorsys.hsv_to_rgb(h / 360.0, 0.7, 0.85)))
+    for h in range(360)
+)
 
 def get_node_color(node_type):
     """Generates a unique and consistent color for a node type."""
-    if node_type not in _node_colors_cache:
-        # Use a hash to get a consistent color for the same node type
-        hue = (hash(node_type + "a_salt_string") % 360) / 360.0
-        rgb = [int(c * 255) for c in colorsys.hsv_to_rgb(hue, 0.7, 0.85)]
-        _node_colors_cache[node_type] = f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
-    return _node_colors_cache[node_type]
+    # Use a hash to get a consistent color for the same node type
+    return _NODE_HUE_LUT[hash(node_type + "a_salt_string") % 360]
 
 def filter_enabled_nodes(workflow_data):
     """Filters and returns only active nodes and links (mode=0) from a workflow."""
     if not isinstance(workflow_data, dict): return {'nodes': [], 'links': []}
     
     active_nodes = [n for n in workflow_data.get("nodes", []) if n.get("mode", 0) == 0]
-    active_node_ids = {str(n["id"]) for n in active_nodes}
+    active_node_ids = frozenset(str(n["id"]) for n in active_nodes)
     
+    is_active = active_node_ids.__contains__  # bound once for the per-link loop
     active_links = [
         l for l in workflow_data.get("links", [])
-        if str(l[1]) in active_node_ids and str(l[3]) in active_node_ids
+        if is_active(str(l[1])) and is_active(str(l[3]))
     ]
     return {"nodes": active_nodes, "links": active_links}
 
+# Input media that generate_node_summary links back to BASE_INPUT_PATH
+NODE_SUMMARY_MEDIA_EXTS = frozenset((
+    '.png', '.jpg', '.jpeg', '.webp', '.gif', '.jfif', '.bmp', '.tiff',
+    '.mp4', '.mov', '.webm', '.mkv', '.avi',
+    '.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac'
+))
+
 def generate_node_summary(workflow_json_string):
     """
     Analyzes a workflow JSON, extracts active nodes, and identifies input media.
     Robust version: handles ComfyUI specific suffixes like ' [output]'.
     """
     try:
-        workflow_data = json.loads(workflow_json_string)
+        workflow_data = fast_json_loads(workflow_json_string)
     except json.JSONDecodeError:
         return None
 
@@ -672,11 +783,7 @@ def generate_node_summary(workflow_json_string):
         is_api_format = True
         for node_id, node_data in workflow_data.items():
             if isinstance(node_data, dict) and 'class_type' in node_data:
-                node_entry = node_data.copy()
-                node_entry['id'] = node_id
-                node_entry['type'] = node_data['class_type']
-                node_entry['inputs'] = node_data.get('inputs', {})
-                nodes.append(node_entry)
+                nodes.append({**node_data, 'id': node_id, 'type': node_data['class_type'], 'inputs': node_data.get('inputs', {})})
 
     if not nodes:
         return []
@@ -691,19 +798,14 @@ def generate_node_summary(workflow_json_string):
             return (float('inf'), raw_id)
 
     sorted_nodes = sorted(nodes, key=lambda n: (
-        NODE_CATEGORIES_ORDER.index(NODE_CATEGORIES.get(n.get('type'), 'others')),
+        NODE_CATEGORY_RANK[NODE_CATEGORIES.get(n.get('type'), 'others')],
         get_id_safe(n)
     ))
     
     summary_list = []
-    
-    valid_media_exts = {
-        '.png', '.jpg', '.jpeg', '.webp', '.gif', '.jfif', '.bmp', '.tiff',
-        '.mp4', '.mov', '.webm', '.mkv', '.avi',
-        '.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac'
-    }
 
-    base_input_norm = os.path.normpath(BASE_INPUT_PATH)
+    # Per-workflow isfile() results: the same input image is often referenced by several nodes
+    isfile_cache = {}
 
     for node in sorted_nodes:
         node_type = node.get('type', 'Unknown')
@@ -733,29 +835,25 @@ def generate_node_summary(workflow_json_string):
             if isinstance(value, str) and value.strip():
                 # 1. Aggressive cleanup to remove suffixes like " [output]" or " [input]"
                 clean_value = value.replace('\\', '/').strip()
-                # Remove common suffixes in square brackets at the end of the string
-                clean_value = re.sub(r'\s*\[.*?\]$', '', clean_value)
-                
-                _, ext = os.path.splitext(clean_value)
+                # Remove common suffixes in square brackets at the end of the string.
+                if clean_value.endswith(']'):
+                    clean_value = RE_BRACKET_SUFFIX.sub('', clean_value)
                 
-                if ext.lower() in valid_media_exts:
+                if get_ext_lower(clean_value) in NODE_SUMMARY_MEDIA_EXTS:
                     filename_only = os.path.basename(clean_value)
                     
-                    candidates = [
-                        os.path.join(BASE_INPUT_PATH, clean_value),
-                        os.path.join(BASE_INPUT_PATH, filename_only),
-                        os.path.normpath(os.path.join(BASE_INPUT_PATH, clean_value))
-                    ]
+                    candidates = [os.path.normpath(os.path.join(BASE_INPUT_PATH_ABS, clean_value))]
+                    if filename_only != clean_value:
+                        candidates.append(os.path.normpath(os.path.join(BASE_INPUT_PATH_ABS, filename_only)))
 
-                    for candidate_path in candidates:
+                    for abs_candidate in candidates:
                         try:
-                            if os.path.isfile(candidate_path):
-                                abs_candidate = os.path.abspath(candidate_path)
-                                abs_base = os.path.abspath(BASE_INPUT_PATH)
-                                
-                                if abs_candidate.startswith(abs_base):
+                            if abs_candidate not in isfile_cache:
+                                isfile_cache[abs_candidate] = os.path.isfile(abs_candidate)
+                            if isfile_cache[abs_candidate]:
+                                if abs_candidate.startswith(BASE_INPUT_PATH_ABS_PREFIX):
                                     is_input_file = True
-                                    rel_path = os.path.relpath(abs_candidate, abs_base).replace('\\', '/')
+                                    rel_path = os.path.relpath(abs_candidate, BASE_INPUT_PATH_ABS).replace('\\', '/')
                                     input_url = f"/galleryout/input_file/{rel_path}"
                                     # Also update the displayed value to clean it up
                                     display_value = clean_value 
@@ -792,6 +890,11 @@ RE_LORA_PROMPT = re.compile(r"<lora:([\w_\s.-]+)(?::([\d.]+))*>", re.IGNORECASE)
 RE_LYCO_PROMPT = re.compile(r"<lyco:([\w_\s.]+):([\d.]+)>", re.IGNORECASE)
 RE_PARENS = re.compile(r"[\\/\[\](){}]+")
 RE_LORA_CLOSE = re.compile(r">\s+")
+RE_BREAK = re.compile(r"\sBREAK\s")
+# Characters not allowed in folder/file names (Windows-safe set)
+RE_INVALID_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|]')
+# ComfyUI annotation suffixes on widget values, e.g. "photo.png [input]"
+RE_BRACKET_SUFFIX = re.compile(r'\s*\[.*?\]$')
 
 def clean_prompt_text(x: str) -> Dict[str, Any]:
     """
@@ -801,11 +904,11 @@ def clean_prompt_text(x: str) -> Dict[str, Any]:
     if not x:
         return {"text": "", "loras": []}
         
-    x = re.sub(r'\sBREAK\s', ' , BREAK , ', x)
-    x = re.sub(RE_LORA_CLOSE, "> , ", x)
+    x = RE_BREAK.sub(' , BREAK , ', x)
+    x = RE_LORA_CLOSE.sub("> , ", x)
     x = x.replace("，", ",").replace("-", " ").replace("_", " ")
     
-    clean_text = re.sub(RE_PARENS, "", x)
+    clean_text = RE_PARENS.sub("", x)
     
     tag_list = [t.strip() for t in x.split(",")]
     lora_list = []
@@ -814,8 +917,8 @@ def clean_prompt_text(x: str) -> Dict[str, Any]:
     for tag in tag_list:
         if not tag: continue
         
-        lora_match = re.search(RE_LORA_PROMPT, tag)
-        lyco_match = re.search(RE_LYCO_PROMPT, tag)
+        lora_match = RE_LORA_PROMPT.search(tag)
+        lyco_match = RE_LYCO_PROMPT.search(tag)
         
         if lora_match:
             val = float(lora_match.group(2)) if lora_match.group(2) else 1.0
@@ -823,7 +926,7 @@ def clean_prompt_text(x: str) -> Dict[str, Any]:
         elif lyco_match:
             lora_list.append({"name": lyco_match.group(1), "value": float(lyco_match.group(2))})
         else:
-            clean_tag = re.sub(RE_PARENS, "", tag).strip()
+            clean_tag = RE_PARENS.sub("", tag).strip()
             if clean_tag:
                 final_tags.append(clean_tag)
 
@@ -1052,43 +1155,142 @@ def safe_delete_file(filepath):
         trash_filename = f"{timestamp}_{filename}"
         trash_path = os.path.join(TRASH_FOLDER, trash_filename)
         
-        # Handle duplicate filenames in trash
+        # Handle duplicate filenames in trash.
+        # FIX: Reserve the name with an exclusive create instead of an exists() check, so two
+        # concurrent deletes of same-named files can never pick (and overwrite) the same target.
         counter = 1
-        while os.path.exists(trash_path):
-            name_without_ext, ext = os.path.splitext(filename)
-            trash_filename = f"{timestamp}_{name_without_ext}_{counter}{ext}"
-            trash_path = os.path.join(TRASH_FOLDER, trash_filename)
-            counter += 1
+        name_without_ext, ext = os.path.splitext(filename)
+        while True:
+            try:
+                with open(trash_path, 'xb'):
+                    break
+            except FileExistsError:
+                trash_filename = f"{timestamp}_{name_without_ext}_{counter}{ext}"
+                trash_path = os.path.join(TRASH_FOLDER, trash_filename)
+                counter += 1
         
-        shutil.move(filepath, trash_path)
+        try:
+            try:
+                # Same filesystem: a metadata-only rename over the placeholder (atomic on Windows too)
+                os.replace(filepath, trash_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV: raise
+                # Trash on another drive: the data has to be copied
+                shutil.move(filepath, trash_path)
+        except OSError:
+            # Source is still in place: drop the placeholder / partial copy
+            if os.path.exists(filepath):
+                try: os.remove(trash_path)
+                except OSError: pass
+            raise
         print(f"INFO: Moved file to trash: {trash_path}")
     else:
         # Permanently delete
         os.remove(filepath)
 
+@lru_cache(maxsize=1)
 def find_ffprobe_path():
     if FFPROBE_MANUAL_PATH and os.path.isfile(FFPROBE_MANUAL_PATH):
         try:
-            subprocess.run([FFPROBE_MANUAL_PATH, "-version"], capture_output=True, check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0)
+            subprocess.run([FFPROBE_MANUAL_PATH, "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0)
             return FFPROBE_MANUAL_PATH
         except Exception: pass
     base_name = "ffprobe.exe" if sys.platform == "win32" else "ffprobe"
     try:
-        subprocess.run([base_name, "-version"], capture_output=True, check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0)
+        subprocess.run([base_name, "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0)
         return base_name
     except Exception: pass
     print("WARNING: ffprobe not found. Video metadata analysis will be disabled.")
     return None
 
+def init_media_worker(ffprobe_path):
+    """ProcessPool initializer: hands the parent's resolved ffprobe path to each worker.
+    Spawned workers (Windows/macOS) re-import the module and would otherwise start with None."""
+    global FFPROBE_EXECUTABLE_PATH
+    FFPROBE_EXECUTABLE_PATH = ffprobe_path
+
+# Media process pools, one per kind of sync job ('sync', 'folder', 'rescan'): an opened folder
+# never queues behind a background job or shares its worker crashes. Idle pools shut down.
+MEDIA_POOL_IDLE_TIMEOUT = 120
+_media_pools = {}
+_media_pool_lock = threading.Lock()
+
+@contextmanager
+def media_pool(kind):
+    """Yields the media ProcessPoolExecutor for one kind of sync job."""
+    with _media_pool_lock:
+        entry = _media_pools.get(kind)
+        if entry is None:
+            entry = {'executor': concurrent.futures.ProcessPoolExecutor(
+                         max_workers=MAX_PARALLEL_WORKERS,
+                         initializer=init_media_worker,
+                         initargs=(FFPROBE_EXECUTABLE_PATH,)),
+                     'jobs': 0, 'timer': None}
+            _media_pools[kind] = entry
+        if entry['timer'] is not None:
+            entry['timer'].cancel()
+            entry['timer'] = None
+        entry['jobs'] += 1
+    try:
+        yield entry['executor']
+    finally:
+        with _media_pool_lock:
+            entry['jobs'] -= 1
+            if entry['jobs'] == 0 and _media_pools.get(kind) is entry:
+                entry['timer'] = threading.Timer(MEDIA_POOL_IDLE_TIMEOUT, _shutdown_idle_media_pool, (kind, entry))
+                entry['timer'].daemon = True
+                entry['timer'].start()
+
+def _shutdown_idle_media_pool(kind, entry):
+    with _media_pool_lock:
+        if entry['jobs'] or _media_pools.get(kind) is not entry:
+            return
+        del _media_pools[kind]
+    entry['executor'].shutdown(wait=False)
+
+def discard_media_pool(executor):
+    """Forgets a pool that raised BrokenProcessPool, so the next job of its kind starts a fresh one."""
+    with _media_pool_lock:
+        for kind, entry in list(_media_pools.items()):
+            if entry['executor'] is executor:
+                del _media_pools[kind]
+                if entry['timer'] is not None: entry['timer'].cancel()
+    executor.shutdown(wait=False)
+
+@atexit.register
+def _shutdown_media_pools():
+    with _media_pool_lock:
+        entries = list(_media_pools.values())
+        _media_pools.clear()
+    for entry in entries:
+        entry['executor'].shutdown(wait=False)
+
+_ffmpeg_path_cache = {}
+
+def get_ffmpeg_path():
+    """Returns the ffmpeg binary that sits next to ffprobe, falling back to the one on PATH."""
+    probe_path = FFPROBE_EXECUTABLE_PATH
+    cached = _ffmpeg_path_cache.get(probe_path)
+    if cached: return cached
+    ffmpeg_name = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
+    ffmpeg_dir = os.path.dirname(probe_path) if probe_path else ''
+    ffmpeg_bin = os.path.join(ffmpeg_dir, ffmpeg_name) if ffmpeg_dir else ffmpeg_name
+    if not os.path.exists(ffmpeg_bin): ffmpeg_bin = ffmpeg_name
+    _ffmpeg_path_cache[probe_path] = ffmpeg_bin
+    return ffmpeg_bin
+
 def _validate_and_get_workflow(json_string):
     try:
-        data = json.loads(json_string)
+        data = fast_json_loads(json_string)
         # Check for UI format (has 'nodes')
         workflow_data = data.get('workflow', data.get('prompt', data))
         
         if isinstance(workflow_data, dict):
+            # An unwrapped workflow is returned as its source text
+            source_json = json_string if workflow_data is data else None
+
             if 'nodes' in workflow_data:
-                return json.dumps(workflow_data), 'ui'
+                return source_json or json.dumps(workflow_data), 'ui'
             
             # Check for API format (keys are IDs, values have class_type)
             # Heuristic: Check if it looks like a dict of nodes
@@ -1098,65 +1300,56 @@ def _validate_and_get_workflow(json_string):
                     is_api = True
                     break
             if is_api:
-                return json.dumps(workflow_data), 'api'
+                return source_json or json.dumps(workflow_data), 'api'
 
     except Exception: 
         pass
 
     return None, None
 
+# Raw fallback scan: files larger than two windows are only scanned at the head and tail
+RAW_SCAN_WINDOW_BYTES = 8 * 1024 * 1024
+
+# Shared decoder: raw_decode() finds the end of a JSON object in C, honouring strings
+_WORKFLOW_JSON_DECODER = json.JSONDecoder()
+
 def _scan_bytes_for_workflow(content_bytes):
     """
-    Generator that yields all valid JSON objects found in the byte stream.
-    Searches for matching curly braces.
+    Generator that yields all valid JSON objects found in the byte stream
+    that could hold a workflow (UI 'nodes' or API 'class_type').
     """
+    # Every workflow format carries one of these keys
+    if b'nodes' not in content_bytes and b'class_type' not in content_bytes:
+        return
+
     try:
         stream_str = content_bytes.decode('utf-8', errors='ignore')
     except Exception:
         return
 
+    raw_decode = _WORKFLOW_JSON_DECODER.raw_decode
     start_pos = 0
     while True:
         first_brace = stream_str.find('{', start_pos)
         if first_brace == -1:
             break
-        
-        open_braces = 0
-        start_index = first_brace
-        
-        for i in range(start_index, len(stream_str)):
-            char = stream_str[i]
-            if char == '{':
-                open_braces += 1
-            elif char == '}':
-                open_braces -= 1
-            
-            if open_braces == 0:
-                candidate = stream_str[start_index : i + 1]
-                # FIX: Use 'except Exception' to allow GeneratorExit to pass through
-                try:
-                    json.loads(candidate)
-                    yield candidate
-                except Exception:
-                    pass
-                
-                # Move start_pos to after this candidate to find the next one
-                start_pos = i + 1
-                break
-        else:
-            # If loop finishes without open_braces hitting 0, no more valid JSON here
-            break
+
+        # FIX: Use 'except Exception' to allow GeneratorExit to pass through
+        try:
+            _, end_index = raw_decode(stream_str, first_brace)
+        except Exception:
+            start_pos = first_brace + 1
+            continue
+
+        yield stream_str[first_brace:end_index]
+        # Move start_pos to after this candidate to find the next one
+        start_pos = end_index
             
-def extract_workflow(filepath, target_type='ui'):
-    """
-    Extracts workflow JSON from image/video files.
-    
-    Args:
-        filepath (str): Path to the file.
-        target_type (str): 'ui' (for visual node graph/version) or 'api' (for real execution values like Seed).
-                           Defaults to 'ui' to restore original compatibility.
-    """
-    ext = os.path.splitext(filepath)[1].lower()
+# Both workflow formats of one file version. Kept small: entries hold full workflow JSON strings.
+@lru_cache(maxsize=64)
+def _discover_workflows(filepath, mtime_ns, size):
+    """Returns {'ui': json_str, 'api': json_str} (either may be missing) for one file version."""
+    ext = get_ext_lower(filepath)
     video_exts = ['.mp4', '.mkv', '.webm', '.mov', '.avi']
     
     found_workflows = {} # Stores {'ui': json_str, 'api': json_str}
@@ -1178,13 +1371,14 @@ def extract_workflow(filepath, target_type='ui'):
             try:
                 cmd = [current_ffprobe_path, '-v', 'quiet', '-print_format', 'json', '-show_format', filepath]
                 result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0)
-                data = json.loads(result.stdout)
-                if 'format' in data and 'tags' in data['format']:
-                    for value in data['format']['tags'].values():
-                        if isinstance(value, str) and value.strip().startswith('{'):
-                            analyze_json(value)
+                tags = fast_json_loads(result.stdout).get('format', {}).get('tags', {})
+                for value in tags.values():
+                    if isinstance(value, str) and value.strip().startswith('{'):
+                        analyze_json(value)
             except Exception: pass
-    else:
+    elif MEDIA_TYPE_BY_EXT.get(ext) != 'audio':
+        # Audio never opens in Pillow (failed identify = a pass over every format plugin);
+        # its embedded workflow is found by the raw byte scan below.
         try:
             with Image.open(filepath) as img:
                 # Check standard keys
@@ -1213,12 +1407,41 @@ def extract_workflow(filepath, target_type='ui'):
     if not found_workflows:
         try:
             with open(filepath, 'rb') as f:
-                content = f.read()
-            for json_str in _scan_bytes_for_workflow(content):
-                analyze_json(json_str)
-                # Optimization: Stop if we found what we wanted
-                if target_type in found_workflows: break
+                file_size = os.fstat(f.fileno()).st_size
+                regions = []
+                if file_size > 0:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        if file_size <= 2 * RAW_SCAN_WINDOW_BYTES:
+                            regions.append(mm[:])
+                        else:
+                            regions.append(mm[:RAW_SCAN_WINDOW_BYTES])
+                            regions.append(mm[-RAW_SCAN_WINDOW_BYTES:])
+            for content in regions:
+                for json_str in _scan_bytes_for_workflow(content):
+                    analyze_json(json_str)
+                    # Optimization: Stop once both formats are known
+                    if len(found_workflows) == 2: break
+                if len(found_workflows) == 2: break
         except Exception: pass
+
+    return found_workflows
+
+def extract_workflow(filepath, target_type='ui', st=None):
+    """
+    Extracts workflow JSON from image/video files.
+    
+    Args:
+        filepath (str): Path to the file.
+        target_type (str): 'ui' (for visual node graph/version) or 'api' (for real execution values like Seed).
+                           Defaults to 'ui' to restore original compatibility.
+        st (os.stat_result): Optional stat of filepath the caller already has (saves a syscall).
+    """
+    if st is None:
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+    found_workflows = _discover_workflows(filepath, st.st_mtime_ns, st.st_size)
                 
     # Return Logic:
     # 1. Return the requested type if found
@@ -1231,42 +1454,44 @@ def extract_workflow(filepath, target_type='ui'):
         
     return None
     
-def is_webp_animated(filepath):
-    try:
-        with Image.open(filepath) as img: return getattr(img, 'is_animated', False)
-    except: return False
-
 def format_duration(seconds):
     if not seconds or seconds < 0: return ""
     m, s = divmod(int(seconds), 60); h, m = divmod(m, 60)
     return f"{h}:{m:02d}:{s:02d}" if h > 0 else f"{m:02d}:{s:02d}"
 
-def analyze_file_metadata(filepath):
+# Extended Type Map for Professional Formats (.webp is resolved per file: static or animated).
+MEDIA_TYPE_BY_EXT = {
+    # Images
+    '.png': 'image', '.jpg': 'image', '.jpeg': 'image', 
+    '.bmp': 'image', '.tiff': 'image', '.tif': 'image',
+    # Animations
+    '.gif': 'animated_image', 
+    # Videos (Standard & Pro)
+    '.mp4': 'video', '.webm': 'video', '.mov': 'video', 
+    '.mkv': 'video', '.avi': 'video', '.m4v': 'video', 
+    '.wmv': 'video', '.flv': 'video', '.mts': 'video', '.ts': 'video',
+    # Audio
+    '.mp3': 'audio', '.wav': 'audio', '.ogg': 'audio', '.flac': 'audio', '.m4a': 'audio'
+}
+
+def analyze_file_metadata(filepath, st=None):
     details = {'type': 'unknown', 'duration': '', 'dimensions': '', 'has_workflow': 0}
-    ext_lower = os.path.splitext(filepath)[1].lower()
+    ext_lower = get_ext_lower(filepath)
     #https://aistudio.google.com/prompts/1uYTqxN6LAJZucWaoD5DlOlljhj0eB1uY#:~:text=function%20showItemAtIndex(index) = {'.png': 'image', '.jpg': 'image', '.jpeg': 'image', '.gif': 'animated_image', '.mp4': 'video', '.webm': 'video', '.mov': 'video', '.mp3': 'audio', '.wav': 'audio', '.ogg': 'audio', '.flac': 'audio'}
-    # Extended Type Map for Professional Formats
-    type_map = {
-        # Images
-        '.png': 'image', '.jpg': 'image', '.jpeg': 'image', 
-        '.bmp': 'image', '.tiff': 'image', '.tif': 'image',
-        # Animations
-        '.gif': 'animated_image', 
-        # Videos (Standard & Pro)
-        '.mp4': 'video', '.webm': 'video', '.mov': 'video', 
-        '.mkv': 'video', '.avi': 'video', '.m4v': 'video', 
-        '.wmv': 'video', '.flv': 'video', '.mts': 'video', '.ts': 'video',
-        # Audio
-        '.mp3': 'audio', '.wav': 'audio', '.ogg': 'audio', '.flac': 'audio', '.m4a': 'audio'
-    }
-    details['type'] = type_map.get(ext_lower, 'unknown')
-    if details['type'] == 'unknown' and ext_lower == '.webp': details['type'] = 'animated_image' if is_webp_animated(filepath) else 'image'
-    if 'image' in details['type']:
-        try:
-            with Image.open(filepath) as img: details['dimensions'] = f"{img.width}x{img.height}"
-        except Exception: pass
-    if extract_workflow(filepath): details['has_workflow'] = 1
+    details['type'] = MEDIA_TYPE_BY_EXT.get(ext_lower, 'unknown')
     total_duration_sec = 0
+    if 'image' in details['type'] or ext_lower == '.webp':
+        try:
+            with Image.open(filepath) as img:
+                is_animated = getattr(img, 'is_animated', False)
+                if ext_lower == '.webp': details['type'] = 'animated_image' if is_animated else 'image'
+                details['dimensions'] = f"{img.width}x{img.height}"
+                if details['type'] == 'animated_image' and is_animated:
+                    if ext_lower == '.gif': total_duration_sec = sum(frame.info.get('duration', 100) for frame in ImageSequence.Iterator(img)) / 1000
+                    elif ext_lower == '.webp': total_duration_sec = getattr(img, 'n_frames', 1) / WEBP_ANIMATED_FPS
+        except Exception:
+            if ext_lower == '.webp': details['type'] = 'image'
+    if extract_workflow(filepath, st=st): details['has_workflow'] = 1
     if details['type'] == 'video':
         try:
             cap = cv2.VideoCapture(filepath)
@@ -1276,13 +1501,6 @@ def analyze_file_metadata(filepath):
                 details['dimensions'] = f"{int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}"
                 cap.release()
         except Exception: pass
-    elif details['type'] == 'animated_image':
-        try:
-            with Image.open(filepath) as img:
-                if getattr(img, 'is_animated', False):
-                    if ext_lower == '.gif': total_duration_sec = sum(frame.info.get('duration', 100) for frame in ImageSequence.Iterator(img)) / 1000
-                    elif ext_lower == '.webp': total_duration_sec = getattr(img, 'n_frames', 1) / WEBP_ANIMATED_FPS
-        except Exception: pass
     if total_duration_sec > 0: details['duration'] = format_duration(total_duration_sec)
     return details
 
@@ -1293,9 +1511,7 @@ def create_waveform(filepath, file_hash, file_type, amp=1.0):
     if os.path.exists(cache_path): return cache_path
     
     try:
-        ffmpeg_name = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
-        ffmpeg_bin = os.path.join(os.path.dirname(FFPROBE_EXECUTABLE_PATH), ffmpeg_name)
-        if not os.path.exists(ffmpeg_bin): ffmpeg_bin = ffmpeg_name
+        ffmpeg_bin = get_ffmpeg_path()
         
         # Generates a white waveform on black background
         cmd =[
@@ -1322,22 +1538,27 @@ def create_thumbnail(filepath, file_hash, file_type):
                 
                 # Handle Animations (Animated WebP / GIF)
                 if file_type == 'animated_image' and getattr(img, 'is_animated', False):
-                    frames = [fr.copy() for fr in ImageSequence.Iterator(img)]
-                    if frames:
-                        for frame in frames: 
-                            frame.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.Resampling.LANCZOS)
-                        
-                        processed_frames = [frame.convert('RGBA').convert('RGB') for frame in frames]
-                        if processed_frames:
-                            processed_frames[0].save(
-                                cache_path, 
-                                save_all=True, 
-                                append_images=processed_frames[1:], 
-                                duration=img.info.get('duration', 100), 
-                                loop=img.info.get('loop', 0), 
-                                optimize=True
-                            )
-                            return cache_path
+                    # Frames are shrunk as they are decoded: one full-size frame in memory at a time
+                    processed_frames = []
+                    for fr in ImageSequence.Iterator(img):
+                        frame = fr.convert('RGBA')
+                        # BILINEAR: this runs once per frame, and at thumbnail size (with thumbnail()'s
+                        # reducing_gap pre-shrink) it is visually indistinguishable from LANCZOS
+                        frame.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.Resampling.BILINEAR)
+                        processed_frames.append(frame.convert('RGB'))
+                    if processed_frames:
+                        # libwebp's fastest method: every frame is encoded, and thumbnails hide the difference
+                        webp_opts = {'method': 0, 'quality': 80} if fmt == 'webp' else {}
+                        processed_frames[0].save(
+                            cache_path, 
+                            save_all=True, 
+                            append_images=processed_frames[1:], 
+                            duration=img.info.get('duration', 100), 
+                            loop=img.info.get('loop', 0), 
+                            optimize=True,
+                            **webp_opts
+                        )
+                        return cache_path
                 
                 # Handle Static Images
                 else:
@@ -1360,9 +1581,13 @@ def create_thumbnail(filepath, file_hash, file_type):
                 success, frame = cap.read()
                 cap.release()
                 if success:
+                    h, w = frame.shape[:2]
+                    scale = min(THUMBNAIL_WIDTH / w, (THUMBNAIL_WIDTH * 2) / h)
+                    if scale < 1:
+                        new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+                        frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
                     frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                     img = Image.fromarray(frame_rgb)
-                    img.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 2), Image.Resampling.LANCZOS)
                     img.save(cache_path, 'JPEG', quality=80)
                     return cache_path
         except Exception: 
@@ -1371,14 +1596,14 @@ def create_thumbnail(filepath, file_hash, file_type):
         # Method B: Fallback to FFmpeg (Most Robust for MKV/AVI/ProRes)
         if FFPROBE_EXECUTABLE_PATH:
             try:
-                ffmpeg_name = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
-                ffmpeg_bin = os.path.join(os.path.dirname(FFPROBE_EXECUTABLE_PATH), ffmpeg_name)
-                if not os.path.exists(ffmpeg_bin): ffmpeg_bin = ffmpeg_name
+                ffmpeg_bin = get_ffmpeg_path()
                 
+                # -ss before -i seeks in the demuxer; -an/-sn/-dn skip the other streams
                 cmd = [
                     ffmpeg_bin, '-y', 
+                    '-ss', '00:00:00', # Seek to start (input seek)
                     '-i', filepath, 
-                    '-ss', '00:00:00', # Seek to start
+                    '-an', '-sn', '-dn', # Video stream only
                     '-vframes', '1',   # Grab 1 frame
                     '-vf', f'scale={THUMBNAIL_WIDTH}:-1', # Resize directly
                     '-q:v', '2',       # High Quality
@@ -1394,21 +1619,39 @@ def create_thumbnail(filepath, file_hash, file_type):
                 print(f"ERROR (FFmpeg): Thumbnail failed for {os.path.basename(filepath)}: {e}")
 
     return None
+
+# Extensions create_thumbnail() can produce (animated GIF/WebP keep their format, everything else is JPEG)
+THUMBNAIL_FORMATS = ('jpeg', 'webp', 'gif')
+
+def find_cached_thumbnail(file_hash):
+    """Returns the cached thumbnail path for a hash, or None."""
+    for fmt in THUMBNAIL_FORMATS:
+        candidate = os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash}.{fmt}")
+        if os.path.isfile(candidate):
+            return candidate
+    return None
     
-def extract_workflow_files_string(workflow_json_string):
+# Extensions that mark a workflow value as a file reference (models, images, video/audio).
+WORKFLOW_FILE_EXTENSIONS = (
+    # Models
+    '.safetensors', '.ckpt', '.pt', '.pth', '.bin', '.gguf', '.lora', '.sft',
+    # Images
+    '.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp', '.tiff',
+    # Video/Audio
+    '.mp4', '.mov', '.webm', '.mkv', '.avi', '.mp3', '.wav', '.ogg', '.flac', '.m4a'
+)
+
+def parse_workflow_nodes(workflow_json_string):
     """
-    Parses workflow and returns a normalized string containing ONLY filenames 
-    (models, images, videos) used in the workflow.
-    
-    Robust version: Handles both UI (widgets_values) and API (inputs) formats safely.
-    Filters out prompts, settings, and comments based on extensions and path structure.
+    Parses a workflow JSON string into a flat list of nodes (UI or API format).
+    Returns None if the string is empty or not valid JSON.
     """
-    if not workflow_json_string: return ""
+    if not workflow_json_string: return None
     
     try:
-        data = json.loads(workflow_json_string)
+        data = fast_json_loads(workflow_json_string)
     except:
-        return ""
+        return None
 
     # Normalize structure (UI vs API format)
     nodes = []
@@ -1421,73 +1664,30 @@ def extract_workflow_files_string(workflow_json_string):
             nodes = list(data.values())
     elif isinstance(data, list):
         nodes = data # Raw list format
+    return nodes
 
-    # 1. Blocklist Nodes (Comments and structural nodes)
-    ignored_types = {'Note', 'NotePrimitive', 'Reroute', 'PrimitiveNode'}
-    
-    # 2. Whitelist Extensions (The most important filter)
-    valid_extensions = {
-        # Models
-        '.safetensors', '.ckpt', '.pt', '.pth', '.bin', '.gguf', '.lora', '.sft',
-        # Images
-        '.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp', '.tiff',
-        # Video/Audio
-        '.mp4', '.mov', '.webm', '.mkv', '.avi', '.mp3', '.wav', '.ogg', '.flac', '.m4a'
-    }
-
-    found_tokens = set()
-    
-    for node in nodes:
-        if not isinstance(node, dict): continue
-        
-        node_type = node.get('type', node.get('class_type', ''))
-        
-        # Skip comment nodes
-        if node_type in ignored_types:
-            continue
-            
-        # Collect values to check from BOTH formats to be safe
-        values_to_check = []
-        
-        # UI Format values
-        w_vals = node.get('widgets_values')
-        if isinstance(w_vals, list):
-            values_to_check.extend(w_vals)
-            
-        # API Format inputs
-        inputs = node.get('inputs')
-        if isinstance(inputs, dict):
-            values_to_check.extend(inputs.values())
-        elif isinstance(inputs, list):
-            values_to_check.extend(inputs)
-
-        for val in values_to_check:
-            # CRITICAL: Only process Strings. API inputs contain Ints/Floats/Lists(links).
-            if isinstance(val, str) and val.strip():
-                # Normalize immediately
-                norm_val = normalize_smart_path(val.strip())
-                
-                # --- FILTER LOGIC ---
-                
-                # Check A: Valid Extension?
-                # We check if the string ends with one of the valid extensions
-                has_valid_ext = any(norm_val.endswith(ext) for ext in valid_extensions)
-                
-                # Check B: Absolute Path? (For folders or files without standard extensions)
-                # Matches "c:/..." or "/home/..."
-                # Must be shorter than 260 chars to avoid catching long prompts starting with /
-                is_abs_path = (len(norm_val) < 260) and (
-                    (len(norm_val) > 2 and norm_val[1] == ':') or # Windows Drive (c:)
-                    norm_val.startswith('/') # Unix/Linux root
-                )
-
-                # Keep ONLY if it looks like a file/path
-                if has_valid_ext or is_abs_path:
-                    found_tokens.add(norm_val)
+# --- Helper to filter out garbage text (Markdown, Stats, Instructions, UI values) ---
 
-    return " ||| ".join(sorted(list(found_tokens)))
+# List of phrases that identify non-prompt text. 
+# Simply add or remove strings here to update the filter.
+GARBAGE_MARKERS = (
+    "ctrl +", "box-select", "don't forget to use", "partial - execution",
+    "creative prompt", "bad quality", "embedding:", "🟢", "select wildcard",
+    "by percentage", "what is art?", "send none", "you are an ai artist",
+    "jpeg压缩残留", "/", "select the wildcard"
+)
+
+# Technical/UI Parameters (Extended Blacklist)
+GARBAGE_UI_KEYWORDS = frozenset({
+    'enable', 'disable', 'fixed', 'randomize', 'auto', 'simple', 'always', 
+    'center', 'left', 'top', 'bottom', 'right', 'nearest', 'bilinear', 
+    'bicubic', 'lanczos', 'keep proportion', 'image', 'default', 'comfyui', 
+    'wan', 'crop', 'input', 'output', 'float', 'int', 'boolean',
+    # Samplers & Schedulers
+    'euler', 'euler_a', 'heun', 'dpm_2', 'dpmpp_2m', 'dpmpp_sde', 'ddim', 
+    'uni_pc', 'lms', 'karras', 'exponential', 'sgd', 'normal'
+})
 
-# --- Helper to filter out garbage text (Markdown, Stats, Instructions, UI values) ---
 def _is_garbage_text(text):
     if not text: return True
     t = text.strip()
@@ -1501,15 +1701,6 @@ def _is_garbage_text(text):
     # 2. Detect Instructions / Notes / Shortcuts / UI Trash
     t_lower = t.lower()
 
-    # List of phrases that identify non-prompt text. 
-    # Simply add or remove strings here to update the filter.
-    GARBAGE_MARKERS = (
-        "ctrl +", "box-select", "don't forget to use", "partial - execution",
-        "creative prompt", "bad quality", "embedding:", "🟢", "select wildcard",
-        "by percentage", "what is art?", "send none", "you are an ai artist",
-        "jpeg压缩残留", "/", "select the wildcard"
-    )
-
     # If any of the markers are found in the text, it is considered garbage
     if any(marker in t_lower for marker in GARBAGE_MARKERS):
         return True
@@ -1521,19 +1712,9 @@ def _is_garbage_text(text):
     # 4. Detect Numbered Lists (common in notes: "1. do this")
     if len(t) > 3 and t[0].isdigit() and t[1] == '.' and t[2] == ' ': return True
 
-    # 5. Detect Technical/UI Parameters (Extended Blacklist)
-    ui_keywords = {
-        'enable', 'disable', 'fixed', 'randomize', 'auto', 'simple', 'always', 
-        'center', 'left', 'top', 'bottom', 'right', 'nearest', 'bilinear', 
-        'bicubic', 'lanczos', 'keep proportion', 'image', 'default', 'comfyui', 
-        'wan', 'crop', 'input', 'output', 'float', 'int', 'boolean',
-        # Samplers & Schedulers
-        'euler', 'euler_a', 'heun', 'dpm_2', 'dpmpp_2m', 'dpmpp_sde', 'ddim', 
-        'uni_pc', 'lms', 'karras', 'exponential', 'sgd', 'normal'
-    }
-    
+    # 5. Detect Technical/UI Parameters (Extended Blacklist, see GARBAGE_UI_KEYWORDS)
     # Check exact match or if it looks like a parameter
-    if t_lower in ui_keywords: return True
+    if t_lower in GARBAGE_UI_KEYWORDS: return True
     
     # 6. Detect Unresolved variables
     if t.startswith('%') or '${' in t: return True
@@ -1541,74 +1722,94 @@ def _is_garbage_text(text):
     return False
 
 
-def extract_workflow_prompt_string(workflow_json_string):
+# Node types skipped by each search column (comments, structural and display/output nodes)
+WORKFLOW_FILES_IGNORED_TYPES = frozenset({'Note', 'NotePrimitive', 'Reroute', 'PrimitiveNode'})
+WORKFLOW_PROMPT_IGNORED_TYPES = frozenset({
+    'Note', 'NotePrimitive', 'Reroute', 'PrimitiveNode', 
+    'ShowText', 'Display Text', 'Simple Text', 'Text Box', 'ComfyUI', 'ExtraMetadata',
+    'SaveImage', 'PreviewImage', 'VHS_VideoCombine', 'VHS_LoadVideo'
+})
+
+def extract_workflow_search_strings(workflow_json_string, nodes=None):
     """
-    Broad extraction for Database Indexing (Searchable Keywords).
-    This function scans ALL nodes to ensure keyword searches work as expected,
-    while filtering out known UI noise and technical instructions.
+    Builds both searchable columns in a single pass over the workflow nodes.
+    Returns (files_string, prompt_string):
+    - files: normalized filenames/paths (models, images, videos) used in the workflow.
+      Handles both UI (widgets_values) and API (inputs) formats; keeps only values that
+      look like files by extension or absolute path.
+    - prompt: broad keyword text for search, with known UI noise and instructions removed.
+    Pass 'nodes' (from parse_workflow_nodes) to reuse an already parsed workflow.
     """
-    if not workflow_json_string: return ""
-    
-    try:
-        data = json.loads(workflow_json_string)
-    except:
-        return ""
+    if nodes is None:
+        nodes = parse_workflow_nodes(workflow_json_string)
+        if nodes is None: return "", ""
 
-    # Normalize structure (UI vs API format)
-    nodes = []
-    if isinstance(data, dict):
-        if 'nodes' in data and isinstance(data['nodes'], list):
-            nodes = data['nodes'] # UI Format
-        else:
-            nodes = list(data.values()) # API Format
-    elif isinstance(data, list):
-        nodes = data 
-    
+    found_tokens = set()
     found_texts = set()
-    
-    # Nodes to strictly ignore for text extraction
-    ignored_types = {
-        'Note', 'NotePrimitive', 'Reroute', 'PrimitiveNode', 
-        'ShowText', 'Display Text', 'Simple Text', 'Text Box', 'ComfyUI', 'ExtraMetadata',
-        'SaveImage', 'PreviewImage', 'VHS_VideoCombine', 'VHS_LoadVideo'
-    }
+    # Workflows repeat values across nodes: each distinct value is filtered once per column
+    files_seen = set()
+    prompt_seen = set()
     
     for node in nodes:
         if not isinstance(node, dict): continue
-        node_type = node.get('type', node.get('class_type', '')).strip()
         
-        if node_type in ignored_types: continue
+        node_type = node.get('type', node.get('class_type', ''))
+        want_files = node_type not in WORKFLOW_FILES_IGNORED_TYPES
+        want_prompt = node_type.strip() not in WORKFLOW_PROMPT_IGNORED_TYPES
+        if not (want_files or want_prompt): continue
 
-        # Collect all possible string values from widgets and inputs
+        # Collect values from BOTH formats: UI widgets_values and API inputs.
         values_to_check = []
-        if 'widgets_values' in node and isinstance(node['widgets_values'], list):
-            values_to_check.extend(node['widgets_values'])
-        if 'inputs' in node and isinstance(node['inputs'], dict):
-            values_to_check.extend(node['inputs'].values())
-
-        for val in values_to_check:
-            if isinstance(val, str) and val.strip():
-                text = val.strip()
-                
+        w_vals = node.get('widgets_values')
+        if isinstance(w_vals, list):
+            values_to_check.extend(w_vals)
+        inputs = node.get('inputs')
+        if isinstance(inputs, dict):
+            values_to_check.extend(inputs.values())
+        # Input lists (UI link slots) only feed the files column, as before.
+        prompt_values_end = len(values_to_check)
+        if want_files and isinstance(inputs, list):
+            values_to_check.extend(inputs)
+        
+        for i, val in enumerate(values_to_check):
+            # CRITICAL: Only process Strings. API inputs contain Ints/Floats/Lists(links).
+            if not isinstance(val, str): continue
+            text = val.strip()
+            if not text: continue
+
+            if want_files and text not in files_seen:
+                files_seen.add(text)
+                # Normalize immediately
+                norm_val = normalize_smart_path(text)
+                # Check A: Valid Extension?
+                has_valid_ext = norm_val.endswith(WORKFLOW_FILE_EXTENSIONS)
+                # Check B: Absolute Path? (For folders or files without standard extensions)
+                # Matches "c:/..." or "/home/..."
+                # Must be shorter than 260 chars to avoid catching long prompts starting with /
+                is_abs_path = (len(norm_val) < 260) and (
+                    (len(norm_val) > 2 and norm_val[1] == ':') or # Windows Drive (c:)
+                    norm_val.startswith('/') # Unix/Linux root
+                )
+                # Keep ONLY if it looks like a file/path
+                if has_valid_ext or is_abs_path:
+                    found_tokens.add(norm_val)
+
+            if want_prompt and i < prompt_values_end and text not in prompt_seen:
+                prompt_seen.add(text)
                 # --- BROAD FILTERING FOR SEARCH ACCURACY ---
-                
                 # A. Global Blacklist check
                 if text in WORKFLOW_PROMPT_BLACKLIST: continue
-                
                 # B. Advanced Garbage filtering (Instructions, technical values, etc.)
                 if _is_garbage_text(text): continue
-                
                 # C. Ignore filenames and short numeric strings
                 if text.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.safetensors', '.ckpt', '.pt')):
                     continue
-                
                 # D. Minimum length for a searchable keyword
                 if len(text) < 3: continue
-
                 found_texts.add(text)
 
-    # Join everything with a separator for the Database field
-    return " , ".join(list(found_texts))
+    # Join everything with a separator for the Database fields
+    return " ||| ".join(sorted(found_tokens)), " , ".join(found_texts)
     
 def process_single_file(filepath):
     """
@@ -1616,18 +1817,19 @@ def process_single_file(filepath):
     Designed to be run in a parallel process pool.
     """
     try:
-        mtime = os.path.getmtime(filepath)
-        metadata = analyze_file_metadata(filepath)
+        st = os.stat(filepath)
+        mtime = st.st_mtime
+        metadata = analyze_file_metadata(filepath, st=st)
         file_hash_for_thumbnail = hashlib.md5((filepath + str(mtime)).encode()).hexdigest()
         
-        if not glob.glob(os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash_for_thumbnail}.*")):
+        if not find_cached_thumbnail(file_hash_for_thumbnail):
             create_thumbnail(filepath, file_hash_for_thumbnail, metadata['type'])
         
         if GENERATE_WAVEFORMS and metadata['type'] in ['video', 'audio']:
             create_waveform(filepath, file_hash_for_thumbnail, metadata['type'])
         
         file_id = hashlib.md5(filepath.encode()).hexdigest()
-        file_size = os.path.getsize(filepath)
+        file_size = st.st_size
         
         # Extract workflow data
         workflow_files_content = ""
@@ -1636,11 +1838,11 @@ def process_single_file(filepath):
         if metadata['has_workflow']:
             # UPDATED: Request 'api' format for indexing to get real execution values (seeds, clean prompts)
             # If not found, extract_workflow will automatically fallback to 'ui'
-            wf_json = extract_workflow(filepath, target_type='api')
+            wf_json = extract_workflow(filepath, target_type='api', st=st)
             
-            if wf_json:
-                workflow_files_content = extract_workflow_files_string(wf_json)
-                workflow_prompt_content = extract_workflow_prompt_string(wf_json) 
+            wf_nodes = parse_workflow_nodes(wf_json)
+            if wf_nodes is not None:
+                workflow_files_content, workflow_prompt_content = extract_workflow_search_strings(wf_json, nodes=wf_nodes)
         
         return (
             file_id, filepath, mtime, os.path.basename(filepath),
@@ -1653,6 +1855,14 @@ def process_single_file(filepath):
         print(f"ERROR: Failed to process file {os.path.basename(filepath)} in worker: {e}")
         return None
         
+# SQLite page cache per connection, in KiB (steady state / during a full sync)
+DB_CACHE_SIZE_KIB = 65536
+SYNC_CACHE_SIZE_KIB = 262144
+
+# Column list for listing queries: every files column except BLOBs (ai_embedding), which
+# the views drop anyway. Rebuilt by init_db() from the live schema.
+FILES_LIST_COLUMNS = "f.*"
+
 def get_db_connection():
     # Timeout increased to 60s to be patient with the Indexer
     conn = sqlite3.connect(DATABASE_FILE, timeout=60)
@@ -1660,12 +1870,93 @@ def get_db_connection():
     # CONCURRENCY OPTIMIZATION:
     conn.execute('PRAGMA journal_mode=WAL;') 
     conn.execute('PRAGMA synchronous=NORMAL;') 
+    conn.execute('PRAGMA temp_store=MEMORY;')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KIB};')
+    conn.execute('PRAGMA mmap_size=268435456;')
     # --- CRITICAL FOR DATA CONSISTENCY ---
     # Enables cascading updates/deletes for Categories/Collections
-    conn.execute('PRAGMA foreign_keys = ON;') 
-    
+    conn.execute('PRAGMA foreign_keys = ON;')
+
     return conn
-    
+
+# One read-only connection per thread for SELECT-only paths (under WAL they never block the writer)
+_read_conn_local = threading.local()
+_read_only_unavailable = False
+
+def get_read_connection():
+    """Returns this thread's cached read-only connection (use only for SELECTs)."""
+    global _read_only_unavailable
+    conn = getattr(_read_conn_local, 'conn', None)
+    if conn is None:
+        if not _read_only_unavailable:
+            try:
+                conn = sqlite3.connect(f"file:{urllib.request.pathname2url(DATABASE_FILE)}?mode=ro", uri=True, timeout=60)
+                conn.row_factory = sqlite3.Row
+                conn.execute('PRAGMA query_only=ON;')
+                conn.execute('PRAGMA temp_store=MEMORY;')
+                conn.execute('PRAGMA cache_size=-32768;')
+                conn.execute('PRAGMA mmap_size=268435456;')
+                # Read-only/WAL problems (e.g. the -shm file cannot be created) only surface on the
+                # first read: probe once so a broken connection is never cached for the thread
+                conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone()
+            except sqlite3.OperationalError as e:
+                print(f"WARNING: Read-only database connections unavailable, using regular ones: {e}")
+                if conn is not None: conn.close()
+                conn = None
+                # Remembered for the whole process: the environment will not change per request
+                _read_only_unavailable = True
+        if conn is None:
+            conn = get_db_connection()
+        _read_conn_local.conn = conn
+    return conn
+
+# --- WORKFLOW PROMPT SEARCH INDEX ---
+# workflow_prompt LIKE '%kw%' filters are answered by an FTS5 trigram index (SQLite >= 3.34).
+# It is an external-content table kept in sync by triggers, so every writer is covered.
+PROMPT_FTS_AVAILABLE = False
+
+def init_prompt_fts(conn):
+    """Creates the trigram index over files.workflow_prompt if SQLite supports it."""
+    global PROMPT_FTS_AVAILABLE
+    try:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_prompt_fts'").fetchone()
+        if not exists:
+            conn.execute("""
+                CREATE VIRTUAL TABLE files_prompt_fts USING fts5(
+                    workflow_prompt, content='files', tokenize='trigram'
+                )
+            """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS files_prompt_fts_ai AFTER INSERT ON files BEGIN
+                INSERT INTO files_prompt_fts(rowid, workflow_prompt) VALUES (new.rowid, new.workflow_prompt);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS files_prompt_fts_ad AFTER DELETE ON files BEGIN
+                INSERT INTO files_prompt_fts(files_prompt_fts, rowid, workflow_prompt) VALUES ('delete', old.rowid, old.workflow_prompt);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS files_prompt_fts_au AFTER UPDATE OF workflow_prompt ON files BEGIN
+                INSERT INTO files_prompt_fts(files_prompt_fts, rowid, workflow_prompt) VALUES ('delete', old.rowid, old.workflow_prompt);
+                INSERT INTO files_prompt_fts(rowid, workflow_prompt) VALUES (new.rowid, new.workflow_prompt);
+            END
+        """)
+        if not exists:
+            print("INFO: Building workflow prompt search index...")
+            conn.execute("INSERT INTO files_prompt_fts(files_prompt_fts) VALUES ('rebuild')")
+        PROMPT_FTS_AVAILABLE = True
+    except sqlite3.OperationalError as e:
+        # Older SQLite builds without FTS5/trigram keep the plain LIKE scan.
+        print(f"WARNING: Workflow prompt search index unavailable ({e}). Using full scan.")
+        PROMPT_FTS_AVAILABLE = False
+
+def prompt_like_condition(column_prefix, is_not):
+    """SQL fragment for a '%kw%' workflow_prompt match, served by the FTS index when available."""
+    if PROMPT_FTS_AVAILABLE and not is_not:
+        return f"{column_prefix}rowid IN (SELECT rowid FROM files_prompt_fts WHERE workflow_prompt LIKE ?)"
+    return f"{column_prefix}workflow_prompt {'NOT LIKE' if is_not else 'LIKE'} ?"
+
 def init_db(conn=None):
     close_conn = False
     if conn is None:
@@ -1897,6 +2188,14 @@ def init_db(conn=None):
                 except Exception as e:
                     print(f"WARNING: Could not add column {col_name}: {e}")
 
+        global FILES_LIST_COLUMNS
+        list_cols = [row['name'] for row in conn.execute("PRAGMA table_info(files)")
+                     if (row['type'] or '').upper() != 'BLOB']
+        if list_cols:
+            FILES_LIST_COLUMNS = ", ".join(f"f.{col}" for col in list_cols)
+
+        init_prompt_fts(conn)
+
         # 6. SCHEMA VERSION
         try:
             cur = conn.execute("PRAGMA user_version")
@@ -1916,8 +2215,27 @@ def init_db(conn=None):
     finally:
         if close_conn: conn.close()
         
+# Snapshot of the last folder-tree walk: (watched_rules, mounted_paths, {dir_path: st_mtime_ns}).
+# Creating, deleting or renaming a folder changes its parent's mtime, so while every recorded
+# mtime matches, the cached config is still valid.
+_folder_tree_snapshot = None
+# Directories modified this recently are not trusted (coarse filesystem timestamps)
+FOLDER_SNAPSHOT_RACY_NS = 2 * 1_000_000_000
+
+def _folder_tree_unchanged(watched_rules, mounted_paths):
+    """True if the folder tree and its DB flags still match the last snapshot."""
+    if _folder_tree_snapshot is None: return False
+    snap_rules, snap_mounts, dir_mtimes = _folder_tree_snapshot
+    if snap_rules != watched_rules or snap_mounts != mounted_paths: return False
+    for dir_path, mtime_ns in dir_mtimes.items():
+        try:
+            if os.stat(dir_path).st_mtime_ns != mtime_ns: return False
+        except OSError:
+            return False
+    return True
+
 def get_dynamic_folder_config(force_refresh=False):
-    global folder_config_cache
+    global folder_config_cache, _folder_tree_snapshot
     if folder_config_cache is not None and not force_refresh:
         return folder_config_cache
 
@@ -1949,7 +2267,7 @@ def get_dynamic_folder_config(force_refresh=False):
         watched_rules = [] 
         if ENABLE_AI_SEARCH:
             try:
-                with get_db_connection() as conn:
+                with get_read_connection() as conn:
                     rows = conn.execute("SELECT path, recursive FROM ai_watched_folders").fetchall()
                     for r in rows:
                         w_path = os.path.normpath(r['path']).replace('\\', '/')
@@ -1959,13 +2277,23 @@ def get_dynamic_folder_config(force_refresh=False):
         # 2. Fetch Mounted Folders (New)
         mounted_paths = set()
         try:
-            with get_db_connection() as conn:
+            with get_read_connection() as conn:
                 rows = conn.execute("SELECT path FROM mounted_folders").fetchall()
                 for r in rows:
                     # Normalize for comparison
                     mounted_paths.add(os.path.normpath(r['path']).replace('\\', '/'))
         except: pass
 
+        if folder_config_cache is not None and _folder_tree_unchanged(watched_rules, mounted_paths):
+            return folder_config_cache
+        _folder_tree_snapshot = None
+
+        dir_mtimes = {}
+        try:
+            dir_mtimes[BASE_OUTPUT_PATH] = os.stat(BASE_OUTPUT_PATH).st_mtime_ns
+        except OSError:
+            pass
+
         all_folders = {}
         for dirpath, dirnames, _ in os.walk(BASE_OUTPUT_PATH):
             dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in [THUMBNAIL_CACHE_FOLDER_NAME, SQLITE_CACHE_FOLDER_NAME, ZIP_CACHE_FOLDER_NAME, AI_MODELS_FOLDER_NAME]]
@@ -1973,7 +2301,9 @@ def get_dynamic_folder_config(force_refresh=False):
                 full_path = os.path.normpath(os.path.join(dirpath, dirname)).replace('\\', '/')
                 relative_path = os.path.relpath(full_path, BASE_OUTPUT_PATH).replace('\\', '/')
                 try:
-                    mtime = os.path.getmtime(full_path)
+                    st = os.stat(full_path)
+                    mtime = st.st_mtime
+                    dir_mtimes[full_path] = st.st_mtime_ns
                 except OSError:
                     mtime = time.time()
                 
@@ -2026,6 +2356,10 @@ def get_dynamic_folder_config(force_refresh=False):
                 'is_explicitly_watched': is_explicitly_watched,
                 'is_mount': is_mount
             }
+
+        # Only trust the snapshot if no folder was modified within the timestamp granularity window
+        if dir_mtimes and max(dir_mtimes.values()) < time.time_ns() - FOLDER_SNAPSHOT_RACY_NS:
+            _folder_tree_snapshot = (watched_rules, mounted_paths, dir_mtimes)
     except FileNotFoundError:
         print(f"WARNING: The base directory '{BASE_OUTPUT_PATH}' was not found.")
     
@@ -2033,6 +2367,19 @@ def get_dynamic_folder_config(force_refresh=False):
     return dynamic_config
     
 # --- BACKGROUND WATCHER THREAD ---
+# Seconds between WAL truncation + PRAGMA optimize runs in the watcher
+DB_MAINTENANCE_INTERVAL = 900
+# Longest idle wait between watcher scans; writers that can make files dirty wake it earlier
+AI_WATCHER_IDLE_INTERVAL = 60
+_ai_watcher_wakeup = threading.Event()
+
+def wake_ai_watcher():
+    """Asks the AI watcher to rescan now (call after committing new/changed file rows)."""
+    _ai_watcher_wakeup.set()
+# Media the AI watcher queues, and folders it never descends into
+AI_WATCH_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.webp', '.gif', '.mp4', '.mov', '.avi', '.webm'})
+AI_WATCH_EXCLUDED_DIRS = frozenset({'.thumbnails_cache', '.sqlite_cache', '.zip_downloads', '.AImodels', 'venv', 'venv-ai', '.git'})
+
 def background_watcher_task():
     """
     Periodically scans watched folders.
@@ -2042,106 +2389,143 @@ def background_watcher_task():
     3. Revives 'completed'/'error' queue entries back to 'pending' if the file is dirty.
     """
     print("INFO: AI Background Watcher started (Incremental Mode).")
+    last_maintenance = time.time()
     while True:
         try:
             if ENABLE_AI_SEARCH:
                 with get_db_connection() as conn:
-                    # 1. Cleanup very old jobs to keep table light (> 3 days)
-                    conn.execute("DELETE FROM ai_indexing_queue WHERE status='completed' AND created_at < ?", (time.time() - 259200,))
-                    
                     watched = conn.execute("SELECT path, recursive FROM ai_watched_folders").fetchall()
-                    
+
+                    # Files that are actively waiting or running are skipped.
+                    # Do NOT skip if it is 'completed' or 'error' (we might need to retry/update).
+                    active_paths = {r[0] for r in conn.execute("""
+                        SELECT file_path FROM ai_indexing_queue 
+                        WHERE status IN ('pending', 'processing', 'waiting_gpu')
+                    """)}
+
+                    queue_rows = []
+                    now = time.time()
                     for row in watched:
                         folder_path = row['path'] 
                         is_recursive = row['recursive']
                         
-                        valid_exts = {'.png','.jpg','.jpeg','.webp','.gif','.mp4','.mov','.avi','.webm'}
-                        EXCLUDED = {'.thumbnails_cache', '.sqlite_cache', '.zip_downloads', '.AImodels', 'venv', 'venv-ai', '.git'}
-                        
                         files_to_check = []
 
                         if os.path.isdir(folder_path):
                             if is_recursive:
                                 for root, dirs, files in os.walk(folder_path, topdown=True):
-                                    dirs[:] = [d for d in dirs if not d.startswith('.') and d not in EXCLUDED]
+                                    dirs[:] = [d for d in dirs if not d.startswith('.') and d not in AI_WATCH_EXCLUDED_DIRS]
                                     for f in files:
-                                        if os.path.splitext(f)[1].lower() in valid_exts:
+                                        if get_ext_lower(f) in AI_WATCH_EXTENSIONS:
                                             files_to_check.append(os.path.join(root, f))
                             else:
                                 try:
-                                    for f in os.listdir(folder_path):
-                                        full = os.path.join(folder_path, f)
-                                        if os.path.isfile(full) and os.path.splitext(f)[1].lower() in valid_exts:
-                                            files_to_check.append(full)
+                                    with os.scandir(folder_path) as entries:
+                                        for entry in entries:
+                                            if get_ext_lower(entry.name) in AI_WATCH_EXTENSIONS and entry.is_file():
+                                                files_to_check.append(entry.path)
                                 except: pass
                         
-                        # Process Candidates
-                        for raw_path in files_to_check:
-                            p_key = get_standardized_path(raw_path)
-                            
-                            # 1. CHECK ACTIVE STATUS
-                            # Only skip if it is actively waiting or running. 
-                            # Do NOT skip if it is 'completed' or 'error' (we might need to retry/update).
-                            active_job = conn.execute("""
-                                SELECT 1 FROM ai_indexing_queue 
-                                WHERE file_path = ? AND status IN ('pending', 'processing', 'waiting_gpu')
-                            """, (p_key,)).fetchone()
-                            
-                            if active_job: 
-                                continue # Busy, come back later
+                        if not files_to_check:
+                            continue
 
-                            # 2. CHECK FILE STATE IN DB
-                            # We need to find the file ID and its scan timestamp
-                            # We use the robust path lookup logic (normalized slash match)
-                            # to ensure we find the record even if slashes differ.
-                            
-                            # Try exact match first
-                            file_row = conn.execute("SELECT id, mtime, ai_last_scanned FROM files WHERE path = ?", (raw_path,)).fetchone()
-                            
-                            # Fallback: Normalized Match
-                            if not file_row:
-                                norm_p = raw_path.replace('\\', '/')
-                                file_row = conn.execute("SELECT id, mtime, ai_last_scanned FROM files WHERE REPLACE(path, '\\', '/') = ?", (norm_p,)).fetchone()
+                        # File state for everything under this folder: exact path first,
+                        # then the normalized (forward slash) form.
+                        norm_prefix = os.path.join(folder_path, '').replace('\\', '/')
+                        rows_by_path, rows_by_norm_path = {}, {}
+                        for r in conn.execute("SELECT path, id, mtime, ai_last_scanned FROM files WHERE REPLACE(path, '\\', '/') LIKE ?", (norm_prefix + '%',)):
+                            rows_by_path[r['path']] = r
+                            rows_by_norm_path.setdefault(r['path'].replace('\\', '/'), r)
 
+                        for raw_path in files_to_check:
+                            file_row = rows_by_path.get(raw_path) or rows_by_norm_path.get(raw_path.replace('\\', '/'))
                             if not file_row:
                                 # File exists on disk but NOT in DB. 
                                 # We cannot index it yet (missing metadata/dimensions).
                                 # The main 'files' sync must run first. We skip it silently.
                                 continue
                             
-                            file_id = file_row['id']
                             last_scan_ts = file_row['ai_last_scanned'] if file_row['ai_last_scanned'] is not None else 0
-                            mtime = file_row['mtime']
                             
-                            # 3. DIRTY CHECK (The Core Incremental Logic)
-                            needs_index = False
-                            
-                            if last_scan_ts == 0:
-                                needs_index = True # Never scanned or Reset by user
-                            elif last_scan_ts < mtime:
-                                needs_index = True # File modified on disk after last scan
-                            
-                            if needs_index:
-                                # UPSERT: If exists (e.g. 'completed'), revive to 'pending'. If new, insert.
-                                # This fixes the issue where completed items were ignored even after reset.
-                                conn.execute("""
-                                    INSERT INTO ai_indexing_queue 
-                                    (file_path, file_id, status, created_at, force_index, params)
-                                    VALUES (?, ?, 'pending', ?, 0, '{}')
-                                    ON CONFLICT(file_path) DO UPDATE SET
-                                        status = 'pending',
-                                        file_id = excluded.file_id,
-                                        created_at = excluded.created_at
-                                """, (p_key, file_id, time.time()))
+                            # DIRTY CHECK (The Core Incremental Logic):
+                            # never scanned / reset by user, or modified on disk after the last scan
+                            if last_scan_ts == 0 or last_scan_ts < file_row['mtime']:
+                                p_key = get_standardized_path(raw_path)
+                                if p_key in active_paths:
+                                    continue # Busy, come back later
+                                queue_rows.append((p_key, file_row['id'], now))
+                                active_paths.add(p_key)
+
+                    # 1. Cleanup very old jobs to keep table light (> 3 days)
+                    conn.execute("DELETE FROM ai_indexing_queue WHERE status='completed' AND created_at < ?", (now - 259200,))
+
+                    if queue_rows:
+                        # UPSERT: If exists (e.g. 'completed'), revive to 'pending'. If new, insert.
+                        # This fixes the issue where completed items were ignored even after reset.
+                        conn.executemany("""
+                            INSERT INTO ai_indexing_queue 
+                            (file_path, file_id, status, created_at, force_index, params)
+                            VALUES (?, ?, 'pending', ?, 0, '{}')
+                            ON CONFLICT(file_path) DO UPDATE SET
+                                status = 'pending',
+                                file_id = excluded.file_id,
+                                created_at = excluded.created_at
+                        """, queue_rows)
                     
                     conn.commit()
+
+                    # Automatic checkpoints never shrink the WAL file: truncate it and refresh
+                    # planner stats every DB_MAINTENANCE_INTERVAL seconds.
+                    if now - last_maintenance >= DB_MAINTENANCE_INTERVAL:
+                        last_maintenance = now
+                        busy, wal_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                        if busy:
+                            print(f"WARNING: WAL checkpoint blocked by active readers ({checkpointed}/{wal_frames} frames copied).")
+                        conn.execute("PRAGMA optimize")
                     
         except Exception as e:
             print(f"Watcher Loop Error: {e}")
             
-        time.sleep(10) # Faster check cycle (10s instead of 60s) to feel responsive
-        
+        # Only sync, copy, move, rename and AI reset create work, and they call wake_ai_watcher()
+        _ai_watcher_wakeup.wait(AI_WATCHER_IDLE_INTERVAL)
+        _ai_watcher_wakeup.clear()
+        
+# Upsert used by every sync path to store process_single_file() results.
+# When a file was modified on disk (mtime moved), its favorite flag and AI data are reset.
+FILES_UPSERT_SQL = """
+    INSERT INTO files (id, path, mtime, name, type, duration, dimensions, has_workflow, size, last_scanned, workflow_files, workflow_prompt) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        path = excluded.path,
+        name = excluded.name,
+        type = excluded.type,
+        duration = excluded.duration,
+        dimensions = excluded.dimensions,
+        has_workflow = excluded.has_workflow,
+        size = excluded.size,
+        last_scanned = excluded.last_scanned,
+        workflow_files = excluded.workflow_files,
+        workflow_prompt = excluded.workflow_prompt,
+        is_favorite = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0 ELSE files.is_favorite END,
+        ai_caption = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL ELSE files.ai_caption END,
+        ai_embedding = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL ELSE files.ai_embedding END,
+        ai_last_scanned = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0 ELSE files.ai_last_scanned END,
+        -- Update mtime at the end
+        mtime = excluded.mtime
+"""
+
 def full_sync_database(conn):
+    # Larger page cache for the scan, restored even if it fails (the caller keeps the connection)
+    conn.execute(f'PRAGMA cache_size=-{SYNC_CACHE_SIZE_KIB};')
+    try:
+        _full_sync_database(conn)
+    finally:
+        try:
+            conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KIB};')
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not restore cache_size after sync: {e}")
+
+def _full_sync_database(conn):
     print("INFO: Starting full file scan...")
     start_time = time.time()
 
@@ -2162,38 +2546,37 @@ def full_sync_database(conn):
         folder_path = folder_data['path']
         if not os.path.isdir(folder_path): continue
         try:
-            for name in os.listdir(folder_path):
-                filepath = os.path.join(folder_path, name)
-                
-                # Check extension against whitelist
-                _, ext = os.path.splitext(name)
-                if os.path.isfile(filepath) and ext.lower() in valid_extensions:
-                    disk_files[filepath] = os.path.getmtime(filepath)
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    # Check extension against whitelist
+                    if get_ext_lower(entry.name) in valid_extensions and entry.is_file():
+                        disk_files[entry.path] = entry.stat().st_mtime
                     
         except OSError as e:
             print(f"WARNING: Could not access folder {folder_path}: {e}")
             
-    db_paths = set(db_files.keys())
-    disk_paths = set(disk_files.keys())
-    
-    to_delete = db_paths - disk_paths
-    to_add = disk_paths - db_paths
-    to_check = disk_paths & db_paths
-    to_update = {path for path in to_check if int(disk_files.get(path, 0)) > int(db_files.get(path, 0))}
+    to_delete = db_files.keys() - disk_files.keys()
+    to_add = disk_files.keys() - db_files.keys()
+    db_mtime = db_files.get
+    to_update = {path for path, mtime in disk_files.items()
+                 if (old_mtime := db_mtime(path)) is not None and int(mtime) > int(old_mtime)}
     
     files_to_process = list(to_add.union(to_update))
     # debug if files_to_process: print(f"{Colors.YELLOW}DEBUG - File to process: {files_to_process}{Colors.RESET}")
     if files_to_process:
         print(f"INFO: Processing {len(files_to_process)} files in parallel using up to {MAX_PARALLEL_WORKERS or 'all'} CPU cores...")
         
-        results = []
+        pending = []
+        inserted_count = 0
         # --- CORRECT BLOCK FOR PROGRESS BAR ---
-        with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_PARALLEL_WORKERS) as executor:
+        with media_pool('sync') as executor:
             # Submit all jobs to the pool and get future objects
             futures = {executor.submit(process_single_file, path): path for path in files_to_process}
-            
-            # Create the progress bar with the correct total
-            with tqdm(total=len(files_to_process), desc="Processing files") as pbar:
+        
+            # Create the progress bar with the correct total.
+            total_files = len(files_to_process)
+            with tqdm(total=total_files, desc="Processing files", mininterval=0.25,
+                      miniters=max(1, total_files // 200), smoothing=0) as pbar:
                 # Iterate over the jobs as they are COMPLETED
                 for future in concurrent.futures.as_completed(futures):
                     # --- FAULT TOLERANCE FIX ---
@@ -2202,60 +2585,29 @@ def full_sync_database(conn):
                     try:
                         result = future.result()
                         if result:
-                            results.append(result)
+                            pending.append(result)
                     except concurrent.futures.process.BrokenProcessPool as e:
                         print(f"\nWARNING: A worker process crashed (likely due to a corrupted file). Recovering... Error: {e}")
+                        discard_media_pool(executor)
                     except Exception as e:
                         file_path_failed = futures[future]
                         print(f"\nWARNING: Unhandled error processing {os.path.basename(file_path_failed)}: {e}")
-                    
+                
+                    if len(pending) >= BATCH_SIZE:
+                        conn.executemany(FILES_UPSERT_SQL, pending)
+                        conn.commit()
+                        inserted_count += len(pending)
+                        pending = []
+                
                     # Update the bar by 1 step for each completed job
                     pbar.update(1)
 
-        if results:
-            print(f"INFO: Inserting {len(results)} processed records into the database...")
-            for i in range(0, len(results), BATCH_SIZE):
-                batch = results[i:i + BATCH_SIZE]
-                conn.executemany("""
-                    INSERT INTO files (id, path, mtime, name, type, duration, dimensions, has_workflow, size, last_scanned, workflow_files, workflow_prompt) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(id) DO UPDATE SET
-                        path = excluded.path,
-                        name = excluded.name,
-                        type = excluded.type,
-                        duration = excluded.duration,
-                        dimensions = excluded.dimensions,
-                        has_workflow = excluded.has_workflow,
-                        size = excluded.size,
-                        last_scanned = excluded.last_scanned,
-                        workflow_files = excluded.workflow_files,
-                        workflow_prompt = excluded.workflow_prompt,
-                        
-                        -- CONDITIONAL LOGIC:
-                        is_favorite = CASE 
-                            WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0  
-                            ELSE files.is_favorite                     
-                        END,
-                        
-                        ai_caption = CASE 
-                            WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL 
-                            ELSE files.ai_caption                        
-                        END,
-                        
-                        ai_embedding = CASE 
-                            WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL 
-                            ELSE files.ai_embedding 
-                        END,
-
-                        ai_last_scanned = CASE 
-                            WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0 
-                            ELSE files.ai_last_scanned 
-                        END,
-
-                        -- Update mtime at the end
-                        mtime = excluded.mtime
-                """, batch) 
-                conn.commit()
+        if pending:
+            # Committed together with the deletions below (one fsync for the tail of the sync)
+            conn.executemany(FILES_UPSERT_SQL, pending)
+            inserted_count += len(pending)
+        if inserted_count:
+            print(f"INFO: Stored {inserted_count} processed records in the database.")
 
     # SAFETY GUARD FOR DISCONNECTED DRIVES
     if to_delete:
@@ -2305,8 +2657,15 @@ def full_sync_database(conn):
             # Clean AI Queue for validly deleted files
             std_paths_to_remove = [(get_standardized_path(p),) for p in safe_to_delete]
             conn.executemany("DELETE FROM ai_indexing_queue WHERE file_path = ?", std_paths_to_remove)
-            
-            conn.commit()
+
+    conn.commit()
+
+    # Refresh planner statistics after bulk writes
+    try:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error as e:
+        print(f"WARNING: PRAGMA optimize failed: {e}")
+    wake_ai_watcher()
 
     print(f"INFO: Full scan completed in {time.time() - start_time:.2f} seconds.")
     
@@ -2317,18 +2676,19 @@ def sync_folder_on_demand(folder_path):
         with get_db_connection() as conn:
             disk_files, valid_extensions = {}, {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4', '.mkv', '.webm', '.mov', '.avi', '.mp3', '.wav', '.ogg', '.flac'}
             if os.path.isdir(folder_path):
-                for name in os.listdir(folder_path):
-                    filepath = os.path.join(folder_path, name)
-                    if os.path.isfile(filepath) and os.path.splitext(name)[1].lower() in valid_extensions:
-                        disk_files[filepath] = os.path.getmtime(filepath)
+                with os.scandir(folder_path) as entries:
+                    for entry in entries:
+                        if get_ext_lower(entry.name) in valid_extensions and entry.is_file():
+                            disk_files[entry.path] = entry.stat().st_mtime
             
             db_files_query = conn.execute("SELECT path, mtime FROM files WHERE path LIKE ?", (folder_path + os.sep + '%',)).fetchall()
             db_files = {row['path']: row['mtime'] for row in db_files_query if os.path.normpath(os.path.dirname(row['path'])) == os.path.normpath(folder_path)}
             
-            disk_filepaths, db_filepaths = set(disk_files.keys()), set(db_files.keys())
-            files_to_add = disk_filepaths - db_filepaths
-            files_to_delete = db_filepaths - disk_filepaths
-            files_to_update = {path for path in (disk_filepaths & db_filepaths) if int(disk_files[path]) > int(db_files[path])}
+            files_to_add = disk_files.keys() - db_files.keys()
+            files_to_delete = db_files.keys() - disk_files.keys()
+            db_mtime = db_files.get
+            files_to_update = {path for path, mtime in disk_files.items()
+                               if (old_mtime := db_mtime(path)) is not None and int(mtime) > int(old_mtime)}
             
             if not files_to_add and not files_to_update and not files_to_delete:
                 yield f"data: {json.dumps({'message': 'Folder is up-to-date.', 'status': 'no_changes', 'current': 1, 'total': 1})}\n\n"
@@ -2343,9 +2703,9 @@ def sync_folder_on_demand(folder_path):
                 data_to_upsert = []
                 processed_count = 0
 
-                with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_PARALLEL_WORKERS) as executor:
+                with media_pool('folder') as executor:
                     futures = {executor.submit(process_single_file, path): path for path in files_to_process}
-                    
+                
                     for future in concurrent.futures.as_completed(futures):
                         # --- FAULT TOLERANCE FIX FOR SYNC ---
                         try:
@@ -2354,10 +2714,16 @@ def sync_folder_on_demand(folder_path):
                                 data_to_upsert.append(result)
                         except concurrent.futures.process.BrokenProcessPool as e:
                             print(f"\nWARNING: A worker process crashed (likely due to a corrupted file). Recovering... Error: {e}")
+                            discard_media_pool(executor)
                         except Exception as e:
                             file_path_failed = futures[future]
                             print(f"\nWARNING: Unhandled error processing {os.path.basename(file_path_failed)}: {e}")
-                        
+                    
+                        if len(data_to_upsert) >= BATCH_SIZE:
+                            conn.executemany(FILES_UPSERT_SQL, data_to_upsert)
+                            conn.commit()
+                            data_to_upsert = []
+                    
                         processed_count += 1
                         path = futures[future]
                         progress_data = {
@@ -2368,50 +2734,13 @@ def sync_folder_on_demand(folder_path):
                         yield f"data: {json.dumps(progress_data)}\n\n"
 
                 if data_to_upsert:
-                    conn.executemany("""
-                        INSERT INTO files (id, path, mtime, name, type, duration, dimensions, has_workflow, size, last_scanned, workflow_files, workflow_prompt) 
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ON CONFLICT(id) DO UPDATE SET
-                            path = excluded.path,
-                            name = excluded.name,
-                            type = excluded.type,
-                            duration = excluded.duration,
-                            dimensions = excluded.dimensions,
-                            has_workflow = excluded.has_workflow,
-                            size = excluded.size,
-                            last_scanned = excluded.last_scanned,
-                            workflow_files = excluded.workflow_files,
-                            workflow_prompt = excluded.workflow_prompt,
-                        
-                            -- CONDITIONAL LOGIC:
-                            is_favorite = CASE 
-                                WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0  
-                                ELSE files.is_favorite                     
-                            END,
-                            
-                            ai_caption = CASE 
-                                WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL 
-                                ELSE files.ai_caption                        
-                            END,
-                            
-                            ai_embedding = CASE 
-                                WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL 
-                                ELSE files.ai_embedding 
-                            END,
-
-                            ai_last_scanned = CASE 
-                                WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0 
-                                ELSE files.ai_last_scanned 
-                            END,
-
-                            -- Update mtime at the end
-                            mtime = excluded.mtime
-                    """, data_to_upsert) 
+                    conn.executemany(FILES_UPSERT_SQL, data_to_upsert)
                     
             if files_to_delete:
                 conn.executemany("DELETE FROM files WHERE path IN (?)", [(p,) for p in files_to_delete])
 
             conn.commit()
+            wake_ai_watcher()
             yield f"data: {json.dumps({'message': 'Sync complete. Reloading...', 'status': 'reloading', 'current': total_files, 'total': total_files})}\n\n"
 
     except Exception as e:
@@ -2436,27 +2765,77 @@ def scan_folder_and_extract_options(folder_path, recursive=False):
                 # Filter out hidden/protected folders in-place
                 dirs[:] = [d for d in dirs if not d.startswith('.') and d not in [THUMBNAIL_CACHE_FOLDER_NAME, SQLITE_CACHE_FOLDER_NAME, ZIP_CACHE_FOLDER_NAME, AI_MODELS_FOLDER_NAME]]
                 for filename in files:
-                    ext = os.path.splitext(filename)[1].lower()
+                    ext = get_ext_lower(filename)
                     if ext and ext not in ['.json', '.sqlite']:
                         file_count += 1
                         extensions.add(ext.lstrip('.'))
-                        if '_' in filename: prefixes.add(filename.split('_')[0])
+                        if '_' in filename: prefixes.add(filename.partition('_')[0])
         else:
             # Single folder scan using os.scandir (faster)
             for entry in os.scandir(folder_path):
                 if entry.is_file():
                     filename = entry.name
-                    ext = os.path.splitext(filename)[1].lower()
+                    ext = get_ext_lower(filename)
                     if ext and ext not in ['.json', '.sqlite']:
                         file_count += 1
                         extensions.add(ext.lstrip('.'))
-                        if '_' in filename: prefixes.add(filename.split('_')[0])
+                        if '_' in filename: prefixes.add(filename.partition('_')[0])
                         
     except Exception as e: 
         print(f"ERROR: Could not scan folder '{folder_path}': {e}")
         
     return file_count, sorted(list(extensions)), sorted(list(prefixes))
 
+# Non-recursive file counts keyed by path -> (directory mtime_ns, count), least recently used first.
+# Adding, removing or renaming an entry bumps the directory mtime, which invalidates the entry.
+_folder_count_cache = {}
+_folder_count_cache_lock = threading.Lock()
+FOLDER_COUNT_CACHE_SIZE = 256
+
+def count_folder_files(folder_path, recursive=False):
+    """
+    Physical file count shown by the gallery page (same rules as scan_folder_and_extract_options).
+    Flat folders are cached per directory mtime.
+    """
+    if recursive:
+        return scan_folder_and_extract_options(folder_path, recursive=True)[0]
+
+    try:
+        dir_st = os.stat(folder_path)
+    except OSError:
+        return 0
+    if not stat.S_ISDIR(dir_st.st_mode):
+        return 0
+
+    dir_mtime = dir_st.st_mtime_ns
+    # Request threads share the cache: the LRU reordering and eviction run under the lock
+    with _folder_count_cache_lock:
+        cached = _folder_count_cache.pop(folder_path, None)
+        if cached and cached[0] == dir_mtime:
+            _folder_count_cache[folder_path] = cached
+            return cached[1]
+
+    file_count = 0
+    try:
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    ext = get_ext_lower(entry.name)
+                    if ext and ext not in ['.json', '.sqlite']:
+                        file_count += 1
+    except Exception as e:
+        print(f"ERROR: Could not scan folder '{folder_path}': {e}")
+        return file_count
+
+    # Same guard as the folder-tree snapshot: a file added within the same (coarse) timestamp
+    # tick as this listing would not change the mtime, so recent directories are not cached.
+    if dir_mtime < time.time_ns() - FOLDER_SNAPSHOT_RACY_NS:
+        with _folder_count_cache_lock:
+            _folder_count_cache[folder_path] = (dir_mtime, file_count)
+            if len(_folder_count_cache) > FOLDER_COUNT_CACHE_SIZE:
+                del _folder_count_cache[next(iter(_folder_count_cache))]
+    return file_count
+
 def cleanup_invalid_watched_folders(conn):
     """
     Checks if watched folders still exist on disk.
@@ -2468,7 +2847,11 @@ def cleanup_invalid_watched_folders(conn):
         
         for row in rows:
             path = row['path']
-            if not os.path.exists(path) or not os.path.isdir(path):
+            try:
+                is_dir = stat.S_ISDIR(os.stat(path).st_mode)
+            except OSError:
+                is_dir = False
+            if not is_dir:
                 # We just WARN the user, we do NOT delete the config.
                 print(f"{Colors.YELLOW}WARN: Watched folder not found (Offline or Deleted): {path}")
                 print(f"      Skipping AI checks for this folder. Config preserved.{Colors.RESET}")
@@ -2671,53 +3054,46 @@ def get_filter_options_from_db(conn, scope, folder_path=None, recursive=False):
     extensions, prefixes = set(), set()
     prefix_limit_reached = False
     
-    # Identical helper to gallery_view for consistency
-    def safe_path_norm(p):
-        if not p: return ""
-        return os.path.normpath(str(p).replace('\\', '/')).replace('\\', '/').lower().rstrip('/')
-
     try:
-        # We fetch all names and paths. For very large DBs (100k+ files), 
-        # this is still faster than failing with a wrong SQL LIKE.
+        if scope == 'global':
+            # Names are cut at their FIRST dot (instr has no reverse form); the extension is the
+            # tail after its last dot. Dot-leading names keep get_ext_lower's ".bashrc" rule.
+            cursor = conn.execute("SELECT DISTINCT instr(name, '.') > 1, substr(name, instr(name, '.')) FROM files WHERE instr(name, '.') > 0")
+            for has_stem, tail in cursor:
+                ext = tail[tail.rfind('.'):].lower() if has_stem else get_ext_lower(tail)
+                if ext:
+                    extensions.add(ext.lstrip('.'))
+
+            # One row past the limit is enough to know the dropdown would overflow
+            cursor = conn.execute("SELECT DISTINCT substr(name, 1, instr(name, '_') - 1) FROM files WHERE instr(name, '_') > 1 LIMIT ?",
+                                  (MAX_PREFIX_DROPDOWN_ITEMS + 1,))
+            prefixes = {row[0] for row in cursor}
+            if len(prefixes) > MAX_PREFIX_DROPDOWN_ITEMS:
+                prefix_limit_reached = True
+                prefixes.clear()
+            return sorted(list(extensions)), sorted(list(prefixes)), prefix_limit_reached
+
         cursor = conn.execute("SELECT name, path FROM files")
-        
-        target_norm = safe_path_norm(folder_path)
+        in_scope = make_folder_scope_matcher(folder_path, recursive)
 
         for row in cursor:
-            f_path_raw = row['path']
-            f_name = row['name']
-            
-            # NORMALIZATION STEP
-            f_path_norm = safe_path_norm(f_path_raw)
-            f_dir_norm = safe_path_norm(os.path.dirname(f_path_norm))
-
-            # FILTERING LOGIC (Same as Gallery View)
-            show_file = False
-            if scope == 'global':
-                show_file = True
-            elif recursive:
-                # Check if it's inside the target folder tree
-                if f_path_norm.startswith(target_norm + '/'):
-                    show_file = True
-            else:
-                # Strict local: must be in this exact folder
-                if f_dir_norm == target_norm:
-                    show_file = True
-
-            if show_file:
-                # 1. Extensions
-                _, ext = os.path.splitext(f_name)
-                if ext: 
-                    extensions.add(ext.lstrip('.').lower())
-                
-                # 2. Prefixes
-                if not prefix_limit_reached and '_' in f_name:
-                    pfx = f_name.split('_')[0]
-                    if pfx:
-                        prefixes.add(pfx)
-                        if len(prefixes) > MAX_PREFIX_DROPDOWN_ITEMS:
-                            prefix_limit_reached = True
-                            prefixes.clear()
+            f_name = row[0]
+            if not in_scope(row[1]):
+                continue
+
+            # 1. Extensions
+            ext = get_ext_lower(f_name)
+            if ext: 
+                extensions.add(ext.lstrip('.'))
+            
+            # 2. Prefixes
+            if not prefix_limit_reached and '_' in f_name:
+                pfx = f_name.partition('_')[0]
+                if pfx:
+                    prefixes.add(pfx)
+                    if len(prefixes) > MAX_PREFIX_DROPDOWN_ITEMS:
+                        prefix_limit_reached = True
+                        prefixes.clear()
                             
     except Exception as e: 
         print(f"Error extracting options: {e}")
@@ -2847,10 +3223,7 @@ def strip_media_metadata(input_path, output_path, file_type):
 
         # --- CASE B: REAL VIDEOS (MP4, MOV, MKV...) ---
         elif file_type == 'video' and FFPROBE_EXECUTABLE_PATH:
-            ffmpeg_dir = os.path.dirname(FFPROBE_EXECUTABLE_PATH)
-            ffmpeg_name = "ffmpeg.exe" if os.name == 'nt' else "ffmpeg"
-            ffmpeg_path = os.path.join(ffmpeg_dir, ffmpeg_name)
-            if not os.path.exists(ffmpeg_path): ffmpeg_path = ffmpeg_name
+            ffmpeg_path = get_ffmpeg_path()
             
             cmd = [
                 ffmpeg_path, '-y',
@@ -3044,7 +3417,7 @@ def ai_queue_search():
 @app.route('/galleryout/ai_check/<session_id>', methods=['GET'])
 def ai_check_status(session_id):
     """Checks the status of a specific search session."""
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         row = conn.execute("SELECT status FROM ai_search_queue WHERE session_id = ?", (session_id,)).fetchone()
         
         if not row:
@@ -3076,7 +3449,7 @@ def api_search_options():
     folders = get_dynamic_folder_config()
     folder_path = folders.get(folder_key, {}).get('path', BASE_OUTPUT_PATH)
     
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         # Now passing the recursive flag to the options extractor
         exts, pfxs, limit_reached = get_filter_options_from_db(conn, scope, folder_path, recursive=is_rec)
         
@@ -3144,6 +3517,24 @@ def compare_files_api():
         
 
 # --- AI MANAGER API ROUTES ---
+def wipe_ai_data(conn, file_ids, dequeue=True):
+    """
+    Clears AI caption/embedding/scan state for file_ids and, if dequeue, drops their queue jobs.
+    The ids go through a temp table (no bound-parameter limit). The caller commits.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS ai_wipe_ids (id TEXT PRIMARY KEY)")
+    try:
+        conn.executemany("INSERT OR IGNORE INTO ai_wipe_ids (id) VALUES (?)", [(fid,) for fid in file_ids])
+        conn.execute("""
+            UPDATE files 
+            SET ai_caption=NULL, ai_embedding=NULL, ai_last_scanned=0, ai_error=NULL 
+            WHERE id IN (SELECT id FROM ai_wipe_ids)
+        """)
+        if dequeue:
+            conn.execute("DELETE FROM ai_indexing_queue WHERE file_id IN (SELECT id FROM ai_wipe_ids)")
+    finally:
+        conn.execute("DELETE FROM ai_wipe_ids")
+
 @app.route('/galleryout/ai_indexing/reset', methods=['POST'])
 @management_api_only
 def ai_indexing_reset():
@@ -3176,51 +3567,20 @@ def ai_indexing_reset():
                 folders = get_dynamic_folder_config()
                 if folder_key in folders:
                     folder_path = folders[folder_key]['path']
-                    # Normalize for robust DB lookup
-                    target_norm = os.path.normpath(folder_path).replace('\\', '/').lower()
-                    if not target_norm.endswith('/'): target_norm += '/'
-                    
-                    # Fetch candidates to wipe
+                    in_scope = make_folder_scope_matcher(folder_path, recursive)
                     cursor = conn.execute("SELECT id, path FROM files WHERE ai_caption IS NOT NULL OR ai_embedding IS NOT NULL")
-                    for row in cursor:
-                        f_path = row['path']
-                        # Normalize DB path
-                        f_path_norm = os.path.normpath(f_path).replace('\\', '/').lower()
-                        
-                        is_match = False
-                        if recursive:
-                            if f_path_norm.startswith(target_norm): is_match = True
-                        else:
-                            # Strict parent check
-                            parent_norm = os.path.dirname(f_path_norm).replace('\\', '/').lower() + '/'
-                            if parent_norm == target_norm: is_match = True
-                            
-                        if is_match:
-                            ids_to_wipe.append(row['id'])
+                    ids_to_wipe = [row['id'] for row in cursor if in_scope(row['path'])]
 
             if ids_to_wipe:
-                # Process in chunks to avoid SQL limits
-                chunk_size = 500
-                for i in range(0, len(ids_to_wipe), chunk_size):
-                    chunk = ids_to_wipe[i:i + chunk_size]
-                    placeholders = ','.join(['?'] * len(chunk))
-                    
-                    # 1. WIPE METADATA (Instant)
-                    conn.execute(f"""
-                        UPDATE files 
-                        SET ai_caption=NULL, ai_embedding=NULL, ai_last_scanned=0, ai_error=NULL 
-                        WHERE id IN ({placeholders})
-                    """, chunk)
-                    
-                    # 2. REMOVE FROM PROCESSING QUEUE (Critical fix)
-                    # We must delete pending jobs for these files to stop the worker from indexing them
-                    conn.execute(f"""
-                        DELETE FROM ai_indexing_queue 
-                        WHERE file_id IN ({placeholders})
-                    """, chunk)
+                # 1. WIPE METADATA (Instant)
+                # 2. REMOVE FROM PROCESSING QUEUE (Critical fix)
+                # We must delete pending jobs for these files to stop the worker from indexing them
+                wipe_ai_data(conn, ids_to_wipe)
                     
                 count = len(ids_to_wipe)
                 conn.commit()
+                # Wiped files inside watched folders are re-queued by the watcher
+                wake_ai_watcher()
                 
         return jsonify({'status': 'success', 'count': count, 'message': f'AI data erased and queue cleared for {count} files.'})
         
@@ -3243,13 +3603,8 @@ def ai_indexing_add_files():
     with get_db_connection() as conn:
         # --- NEW: WIPE DATA IF FORCED ---
         if force_index and file_ids:
-            # We must wipe database fields before queuing
-            placeholders = ','.join(['?'] * len(file_ids))
-            conn.execute(f"""
-                UPDATE files 
-                SET ai_caption=NULL, ai_embedding=NULL, ai_last_scanned=0, ai_error=NULL 
-                WHERE id IN ({placeholders})
-            """, file_ids)
+            # We must wipe database fields before queuing (the jobs are re-queued below)
+            wipe_ai_data(conn, file_ids, dequeue=False)
 
         for fid in file_ids:
             # Check current status
@@ -3348,10 +3703,10 @@ def ai_indexing_add_folder():
                 for r, d, f in os.walk(raw_path, topdown=True, followlinks=False):
                     d[:] = [x for x in d if not x.startswith('.') and x not in exc]
                     for x in f:
-                        if os.path.splitext(x)[1].lower() in valid: files_found.append(os.path.join(r, x))
+                        if get_ext_lower(x) in valid: files_found.append(os.path.join(r, x))
             else:
                 for entry in os.scandir(raw_path):
-                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in valid: files_found.append(entry.path)
+                    if get_ext_lower(entry.name) in valid and entry.is_file(): files_found.append(entry.path)
         except: return
 
         # Optimize: Batch Operations
@@ -3360,21 +3715,24 @@ def ai_indexing_add_folder():
             ids_to_wipe = []
             queue_entries = []
             
+            # One read of every row that can match a file under this folder. Both LIKE
+            # prefixes only widen the set (ASCII case-insensitive, '_'/'%' wildcards).
+            norm_prefix = os.path.join(raw_path, '').replace('\\', '/')
+            std_prefix = get_standardized_path(raw_path)
+            if not std_prefix.endswith('/'): std_prefix += '/'
+            rows_by_path, rows_by_norm_path = {}, {}
+            for r in conn.execute("SELECT id, path, mtime, ai_last_scanned FROM files WHERE REPLACE(path, '\\', '/') LIKE ? OR path LIKE ?", (norm_prefix + '%', std_prefix + '%')):
+                rows_by_path[r['path']] = r
+                rows_by_norm_path.setdefault(r['path'].replace('\\', '/'), r)
+            
             for fp in files_found:
                 pk = get_standardized_path(fp)
                 
                 # --- ROBUST LOOKUP START (YOUR LOGIC) ---
                 # 1. Try exact match
-                row = conn.execute("SELECT id, mtime, ai_last_scanned FROM files WHERE path=?", (fp,)).fetchone()
-                
                 # 2. Try standardized match (case insensitive on Windows)
-                if not row: 
-                    row = conn.execute("SELECT id, mtime, ai_last_scanned FROM files WHERE path=?", (pk,)).fetchone()
-                
                 # 3. Try Normalized Slash match (Fixes subfolder mismatch issues)
-                if not row:
-                    norm_p = fp.replace('\\', '/')
-                    row = conn.execute("SELECT id, mtime, ai_last_scanned FROM files WHERE REPLACE(path, '\\', '/') = ?", (norm_p,)).fetchone()
+                row = rows_by_path.get(fp) or rows_by_path.get(pk) or rows_by_norm_path.get(fp.replace('\\', '/'))
                 # --- ROBUST LOOKUP END ---
                 
                 should_queue = False
@@ -3397,15 +3755,8 @@ def ai_indexing_add_folder():
 
             # 3. WIPE OLD DATA IF FORCED
             if ids_to_wipe:
-                chunk_size = 500
-                for i in range(0, len(ids_to_wipe), chunk_size):
-                    chunk = ids_to_wipe[i:i + chunk_size]
-                    placeholders = ','.join(['?'] * len(chunk))
-                    conn.execute(f"""
-                        UPDATE files 
-                        SET ai_caption=NULL, ai_embedding=NULL, ai_last_scanned=0, ai_error=NULL 
-                        WHERE id IN ({placeholders})
-                    """, chunk)
+                # Jobs are re-queued below with force_index
+                wipe_ai_data(conn, ids_to_wipe, dequeue=False)
 
             # 4. BATCH INSERT INTO QUEUE (UPSERT)
             if queue_entries:
@@ -3450,22 +3801,21 @@ def ai_watched_folders():
                 # 3. WIPE DATA (Optional User Choice)
                 if request.json.get('reset_data'):
                     std_target = get_standardized_path(path)
-                    rows = conn.execute("SELECT id, path FROM files WHERE ai_caption IS NOT NULL OR ai_embedding IS NOT NULL").fetchall()
+                    dir_matches = {}
                     ids_to_wipe = []
-                    for r in rows:
-                        p_std = get_standardized_path(r['path'])
-                        if p_std == std_target or p_std.startswith(std_target + '/'):
+                    for r in conn.execute("SELECT id, path FROM files WHERE ai_caption IS NOT NULL OR ai_embedding IS NOT NULL"):
+                        f_dir = os.path.dirname(r['path'])
+                        is_match = dir_matches.get(f_dir)
+                        if is_match is None:
+                            d_std = get_standardized_path(f_dir)
+                            is_match = d_std == std_target or d_std.startswith(std_target + '/')
+                            dir_matches[f_dir] = is_match
+                        if is_match:
                             ids_to_wipe.append(r['id'])
                     
                     if ids_to_wipe:
-                        # Chunk processing for huge folders
-                        chunk_size = 500
-                        for i in range(0, len(ids_to_wipe), chunk_size):
-                            chunk = ids_to_wipe[i:i+chunk_size]
-                            ph = ','.join(['?'] * len(chunk))
-                            conn.execute(f"UPDATE files SET ai_caption=NULL, ai_embedding=NULL, ai_last_scanned=0, ai_error=NULL WHERE id IN ({ph})", chunk)
-                            # (Queue already cleared above by path, but redundant check by ID is safe)
-                            conn.execute(f"DELETE FROM ai_indexing_queue WHERE file_id IN ({ph})", chunk)
+                        # (Queue already cleared above by path, but redundant check by ID is safe)
+                        wipe_ai_data(conn, ids_to_wipe)
                 
                 conn.commit()
                 # --- FORCE CONFIG REFRESH TO UPDATE UI COLORS IMMEDIATELY ---
@@ -3491,7 +3841,7 @@ def ai_watched_folders():
 def ai_indexing_status():
     if not ENABLE_AI_SEARCH: return jsonify({})
     try:
-        with get_db_connection() as conn:
+        with get_read_connection() as conn:
             pending = conn.execute("SELECT COUNT(*) FROM ai_indexing_queue WHERE status='pending'").fetchone()[0]
             processing = conn.execute("SELECT file_path FROM ai_indexing_queue WHERE status='processing'").fetchone()
             
@@ -3577,7 +3927,7 @@ def gallery_view(folder_key):
         # --- NEW GRACEFUL ROLE PROTECTION ---
         if is_management_side:
             user_role = session.get('role')
-            if user_role not in ['ADMIN', 'MANAGER', 'STAFF']:
+            if user_role not in PRIVILEGED_ROLES:
                 # Block GUESTs or CUSTOMERs from management interface
                 session.clear() 
                 return render_template('exhibition_login.html', 
@@ -3638,33 +3988,26 @@ def gallery_view(folder_key):
 
     # --- PATH A: AI SEARCH RESULTS ---
     if ENABLE_AI_SEARCH and ai_session_id:
-        with get_db_connection() as conn:
+        with get_read_connection() as conn:
             try:
                 queue_info = conn.execute("SELECT query, status FROM ai_search_queue WHERE session_id = ?", (ai_session_id,)).fetchone()
                 if queue_info and queue_info['status'] == 'completed':
                     is_ai_search = True
                     ai_query_text = queue_info['query']
-                    rows = conn.execute('''
-                        SELECT f.*, r.score FROM ai_search_results r
+                    rows = conn.execute(f'''
+                        SELECT {FILES_LIST_COLUMNS}, r.score FROM ai_search_results r
                         JOIN files f ON r.file_id = f.id
                         WHERE r.session_id = ? ORDER BY r.score DESC
                     ''', (ai_session_id,)).fetchall()
                     
-                    files_list = []
-                    for row in rows:
-                        d = dict(row)
-                        if 'ai_embedding' in d: 
-                            del d['ai_embedding'] 
-                        files_list.append(d)
-                    
-                    gallery_view_cache = files_list
+                    gallery_view_cache = [dict(row) for row in rows]
             except Exception as e:
                 print(f"AI Search Error: {e}")
                 is_ai_search = False
 
     # --- PATH B: STANDARD VIEW / SEARCH ---
     if not is_ai_search:
-        with get_db_connection() as conn:
+        with get_read_connection() as conn:
             conditions, params = [], []
 
             if search_term:
@@ -3730,7 +4073,7 @@ def gallery_view(folder_key):
                             cond_str = f"{col_expr} {'NOT LIKE' if is_not else 'LIKE'} ?"
                             param_val = f"% {clean_s} %"
                         else:
-                            cond_str = f"workflow_prompt {'NOT LIKE' if is_not else 'LIKE'} ?"
+                            cond_str = prompt_like_condition('', is_not)
                             param_val = f"%{s}%"
                             
                         if is_not:
@@ -3844,7 +4187,7 @@ def gallery_view(folder_key):
             # Allow Local Admin (no force login) to see all comments during sort
             is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
             
-            if is_local_admin or user_role in ['ADMIN', 'MANAGER', 'STAFF']:
+            if is_local_admin or user_role in PRIVILEGED_ROLES:
                 comment_sub_filter = ""
                 comment_exists_filter = "SELECT file_id FROM file_comments"
             else:
@@ -3890,7 +4233,7 @@ def gallery_view(folder_key):
             where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
             
             query = f"""
-                SELECT f.*,
+                SELECT {FILES_LIST_COLUMNS},
                 (
                     SELECT c.color 
                     FROM collections c 
@@ -3919,28 +4262,12 @@ def gallery_view(folder_key):
             rows = conn.execute(query, params).fetchall()
             
             final_files = []
-            
-            def safe_path_norm(p):
-                if not p: return ""
-                return os.path.normpath(str(p).replace('\\', '/')).replace('\\', '/').lower().rstrip('/')
-
-            target_norm = safe_path_norm(folder_path)
+            in_scope = None if is_global_search else make_folder_scope_matcher(folder_path, is_recursive)
             
             for row in rows:
-                f_data = dict(row)
-                if 'ai_embedding' in f_data: del f_data['ai_embedding']
-                
-                f_path_norm = safe_path_norm(f_data['path'])
-                f_dir_norm = safe_path_norm(os.path.dirname(f_path_norm))
-                
-                if is_global_search:
-                    final_files.append(f_data)
-                elif is_recursive:
-                    if f_path_norm.startswith(target_norm + '/'):
-                        final_files.append(f_data)
-                else:
-                    if f_dir_norm == target_norm:
-                        final_files.append(f_data)
+                if in_scope is not None and not in_scope(row['path']):
+                    continue
+                final_files.append(dict(row))
             
             gallery_view_cache = final_files
 
@@ -3960,9 +4287,9 @@ def gallery_view(folder_key):
     if ENABLE_AI_SEARCH and request.args.get('no_ai_caption') == 'true': active_filters_count += 1
     if is_global_search or is_recursive: active_filters_count += 1
 
-    total_folder_files, _, _ = scan_folder_and_extract_options(folder_path, recursive=is_recursive)
+    total_folder_files = count_folder_files(folder_path, recursive=is_recursive)
     total_db_files = 0 
-    with get_db_connection() as conn_opts:
+    with get_read_connection() as conn_opts:
         try:
             total_db_files = conn_opts.execute("SELECT COUNT(*) FROM files").fetchone()[0]
         except:
@@ -3992,13 +4319,6 @@ def gallery_view(folder_key):
         breadcrumbs.append({'key': '_root_', 'display_name': 'Exhibition Home'})
     
     # --- TEMPLATE SELECTION ---
-    try:
-        with get_db_connection() as conn_opts:
-            users_rows = conn_opts.execute("SELECT user_id, full_name FROM users WHERE is_active=1 AND username != 'admin'").fetchall()
-            available_raters = [{'id': str(r['user_id']), 'name': r['full_name']} for r in users_rows]
-    except:
-        available_raters =[]
-    available_raters.insert(0, {'id': 'admin', 'name': 'System Admin'})
     template_name = 'exhibition.html' if IS_EXHIBITION_MODE else 'index.html'
 
     return render_template(template_name, 
@@ -4080,44 +4400,34 @@ def background_rescan_worker(job_id, files_to_process):
             processed_count = 0
             results = []
             
-            with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_PARALLEL_WORKERS) as executor:
+            with media_pool('rescan') as executor:
                 futures = {executor.submit(process_single_file, path): path for path in files_to_process}
-                
+            
                 for future in concurrent.futures.as_completed(futures):
                     try:
                         result = future.result()
                         if result:
                             results.append(result)
-                        
+                    
+                        if len(results) >= BATCH_SIZE:
+                            conn.executemany(FILES_UPSERT_SQL, results)
+                            conn.commit()
+                            results = []
+                    
                         processed_count += 1
                         # UPDATE PROGRESS
                         rescan_jobs[job_id]['current'] = processed_count
-                        
+                    
+                    except concurrent.futures.process.BrokenProcessPool as e:
+                        print(f"ERROR: Worker failed for a file: {e}")
+                        discard_media_pool(executor)
                     except Exception as e:
                         print(f"ERROR: Worker failed for a file: {e}")
 
             if results:
-                conn.executemany("""
-                    INSERT INTO files (id, path, mtime, name, type, duration, dimensions, has_workflow, size, last_scanned, workflow_files, workflow_prompt) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(id) DO UPDATE SET
-                        path = excluded.path,
-                        name = excluded.name,
-                        type = excluded.type,
-                        duration = excluded.duration,
-                        dimensions = excluded.dimensions,
-                        has_workflow = excluded.has_workflow,
-                        size = excluded.size,
-                        last_scanned = excluded.last_scanned,
-                        workflow_files = excluded.workflow_files,
-                        workflow_prompt = excluded.workflow_prompt,
-                        is_favorite = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0 ELSE files.is_favorite END,
-                        ai_caption = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL ELSE files.ai_caption END,
-                        ai_embedding = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN NULL ELSE files.ai_embedding END,
-                        ai_last_scanned = CASE WHEN ABS(files.mtime - excluded.mtime) > 0.1 THEN 0 ELSE files.ai_last_scanned END,
-                        mtime = excluded.mtime
-                """, results) 
+                conn.executemany(FILES_UPSERT_SQL, results)
                 conn.commit()
+        wake_ai_watcher()
                 
         print(f"INFO: [Background] Job {job_id} finished.")
         rescan_jobs[job_id]['status'] = 'done'
@@ -4202,7 +4512,7 @@ def create_folder():
     parent_key = data.get('parent_key', '_root_')
 
     raw_name = data.get('folder_name', '').strip()
-    folder_name = re.sub(r'[\\/:*?"<>|]', '', raw_name)
+    folder_name = RE_INVALID_FILENAME_CHARS.sub('', raw_name)
     
     if not folder_name or folder_name in ['.', '..']: 
         return jsonify({'status': 'error', 'message': 'Invalid folder name provided.'}), 400
@@ -4226,7 +4536,7 @@ def mount_folder():
     target_path_raw = data.get('target_path', '').strip()
     
     # Sanitize name
-    link_name = re.sub(r'[\\/:*?"<>|]', '', link_name_raw)
+    link_name = RE_INVALID_FILENAME_CHARS.sub('', link_name_raw)
     
     if not link_name or not target_path_raw:
         return jsonify({'status': 'error', 'message': 'Missing name or target path.'}), 400
@@ -4234,7 +4544,11 @@ def mount_folder():
     # Security: Normalize target path
     target_path = os.path.normpath(target_path_raw)
     
-    if not os.path.exists(target_path) or not os.path.isdir(target_path):
+    try:
+        target_is_dir = stat.S_ISDIR(os.stat(target_path).st_mode)
+    except OSError:
+        target_is_dir = False
+    if not target_is_dir:
         return jsonify({'status': 'error', 'message': f'Target path does not exist: {target_path}'}), 404
         
     # Construct link path inside BASE_OUTPUT_PATH
@@ -4462,6 +4776,14 @@ def browse_filesystem():
    
 # --- ZIP BACKGROUND JOB MANAGEMENT ---
 zip_jobs = {}
+# Copy buffer for streaming files into archives (ZipFile.write() uses 8 KB reads)
+ZIP_COPY_BUFFER_SIZE = 64 * 1024
+# Already entropy-coded formats: deflate burns CPU for ~0% gain, so they are stored as-is
+ZIP_STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.jfif', '.webp', '.gif',
+    '.mp4', '.webm', '.mov', '.mkv', '.avi', '.m4v', '.wmv', '.flv',
+    '.mp3', '.ogg', '.flac', '.m4a', '.aac'
+}
 def background_zip_task(job_id, file_ids):
     try:
         if not os.path.exists(ZIP_CACHE_DIR):
@@ -4490,8 +4812,14 @@ def background_zip_task(job_id, file_ids):
                 file_name = file_row['name']
                 # Check the file esists 
                 if os.path.exists(file_path):
-                    # Add file to zip
-                    zf.write(file_path, file_name)
+                    # Add file to zip (same as zf.write, with 64 KB reads)
+                    zinfo = zipfile.ZipInfo.from_file(file_path, file_name)
+                    if get_ext_lower(file_name) in ZIP_STORED_EXTENSIONS:
+                        zinfo.compress_type = zipfile.ZIP_STORED
+                    else:
+                        zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    with open(file_path, 'rb') as src, zf.open(zinfo, 'w') as dst:
+                        shutil.copyfileobj(src, dst, ZIP_COPY_BUFFER_SIZE)
         
         # Job completed succesfully
         zip_jobs[job_id] = {
@@ -4502,10 +4830,10 @@ def background_zip_task(job_id, file_ids):
         # Clean automatic: delete zip older than 24 hours
         try:
             now = time.time()
-            for f in os.listdir(ZIP_CACHE_DIR):
-                fp = os.path.join(ZIP_CACHE_DIR, f)
-                if os.path.isfile(fp) and os.stat(fp).st_mtime < now - 86400:
-                    os.remove(fp)
+            with os.scandir(ZIP_CACHE_DIR) as it:
+                for entry in it:
+                    if entry.is_file() and entry.stat().st_mtime < now - 86400:
+                        os.remove(entry.path)
         except Exception: 
             pass
 
@@ -4534,11 +4862,9 @@ def check_zip_status(job_id):
     job = zip_jobs.get(job_id)
     if not job:
         return jsonify({'status': 'error', 'message': 'Job not found'}), 404
-    response_data = job.copy()
     if job['status'] == 'ready' and 'filename' in job:
-        response_data['download_url'] = url_for('serve_zip_file', filename=job['filename'])
-        
-    return jsonify(response_data)
+        return jsonify({**job, 'download_url': url_for('serve_zip_file', filename=job['filename'])})
+    return jsonify(job)
     
 @app.route('/galleryout/serve_zip/<filename>')
 def serve_zip_file(filename):
@@ -4550,7 +4876,7 @@ def rename_folder(folder_key):
     if folder_key in PROTECTED_FOLDER_KEYS: return jsonify({'status': 'error', 'message': 'This folder cannot be renamed.'}), 403
     
     raw_name = request.json.get('new_name', '').strip()
-    new_name = re.sub(r'[\\/:*?"<>|]', '', raw_name)
+    new_name = RE_INVALID_FILENAME_CHARS.sub('', raw_name)
     
     if not new_name or new_name in ['.', '..']: 
         return jsonify({'status': 'error', 'message': 'Invalid name.'}), 400
@@ -4710,7 +5036,7 @@ def load_more():
     return jsonify(files=gallery_view_cache[offset:offset + PAGE_SIZE])
 
 def get_file_info_from_db(file_id, column='*'):
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         row = conn.execute(f"SELECT {column} FROM files WHERE id = ?", (file_id,)).fetchone()
     if not row: abort(404)
     return dict(row) if column == '*' else row[0]
@@ -4855,6 +5181,8 @@ def move_batch():
                 print(f"ERROR: Failed to move file {filename_for_error}. Reason: {e}")
                 continue
         conn.commit()
+    # Moved rows keep their AI state; unindexed ones may now sit in a watched folder
+    if moved_count: wake_ai_watcher()
     
     message = f"Successfully moved {moved_count} file(s)."
     if skipped_count > 0: message += f" {skipped_count} skipped (same folder)."
@@ -4937,6 +5265,8 @@ def copy_batch():
                 failed_files.append(source_filename)
                 
         conn.commit()
+    # Copies get a new mtime, so the watcher re-queues them for AI indexing
+    if copied_count: wake_ai_watcher()
         
     msg = f"Successfully copied {copied_count} files."
     status = 'success'
@@ -5070,7 +5400,7 @@ def rename_file(file_id):
 
     if not new_name or len(new_name) > 250:
         return jsonify({'status': 'error', 'message': 'Invalid filename.'}), 400
-    if re.search(r'[\\/:"*?<>|]', new_name):
+    if RE_INVALID_FILENAME_CHARS.search(new_name):
         return jsonify({'status': 'error', 'message': 'Invalid characters.'}), 400
 
     try:
@@ -5155,6 +5485,8 @@ def rename_file(file_id):
                             (new_id, new_path, final_new_name, file_id))
 
             conn.commit()
+            # The renamed path may still be waiting for AI indexing in a watched folder
+            wake_ai_watcher()
 
             return jsonify({
                 'status': 'success',
@@ -5208,8 +5540,8 @@ def serve_cleaned_file(file_id):
             
     # Serve the file with correct mimetype for WebP
     if filepath.lower().endswith('.webp'):
-        return send_file(clean_path, mimetype='image/webp')
-    return send_file(clean_path)
+        return send_file(clean_path, mimetype='image/webp', conditional=True)
+    return send_file(clean_path, conditional=True)
     
 @app.route('/galleryout/file/<string:file_id>')
 def serve_file(file_id):
@@ -5217,10 +5549,11 @@ def serve_file(file_id):
         return serve_cleaned_file(file_id)
     
     # Default: serve original
+    # conditional=True answers Range requests (video seeking) with 206 slices
     filepath = get_file_info_from_db(file_id, 'path')
     if filepath.lower().endswith('.webp'): 
-        return send_file(filepath, mimetype='image/webp')
-    return send_file(filepath)
+        return send_file(filepath, mimetype='image/webp', conditional=True)
+    return send_file(filepath, conditional=True)
 
         
 @app.route('/galleryout/download/<string:file_id>')
@@ -5358,16 +5691,28 @@ def serve_waveform(file_id):
             
     abort(404)
 
+# Browser cache lifetime for thumbnails. The URL is keyed by file id (path), so it is not
+# immutable: after this window the browser revalidates and gets a 304 if nothing changed.
+THUMBNAIL_MAX_AGE = 3600
+
+def _send_thumbnail(cache_path, file_hash):
+    """send_file for thumbnails: ETag = path+mtime hash, private caching, 304 on revalidation."""
+    response = send_file(cache_path, conditional=True, etag=file_hash, max_age=THUMBNAIL_MAX_AGE)
+    # Galleries can be login-protected: allow the browser cache only, never shared proxies
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
 @app.route('/galleryout/thumbnail/<string:file_id>')
 def serve_thumbnail(file_id):
     info = get_file_info_from_db(file_id)
     filepath, mtime = info['path'], info['mtime']
     file_hash = hashlib.md5((filepath + str(mtime)).encode()).hexdigest()
-    existing_thumbnails = glob.glob(os.path.join(THUMBNAIL_CACHE_DIR, f"{file_hash}.*"))
-    if existing_thumbnails: return send_file(existing_thumbnails[0])
+    existing_thumbnail = find_cached_thumbnail(file_hash)
+    if existing_thumbnail: return _send_thumbnail(existing_thumbnail, file_hash)
     print(f"WARN: Thumbnail not found for {os.path.basename(filepath)}, generating...")
     cache_path = create_thumbnail(filepath, file_hash, info['type'])
-    if cache_path and os.path.exists(cache_path): return send_file(cache_path)
+    if cache_path and os.path.exists(cache_path): return _send_thumbnail(cache_path, file_hash)
     return "Thumbnail generation failed", 404
 
 # --- STORYBOARD (GRID SYSTEM) - FAST + SMART CORRUPTION DETECTION ---
@@ -5393,7 +5738,8 @@ def get_storyboard(file_id):
         
         # Return cached results immediately if available
         if os.path.exists(cache_subdir):
-            cached_files = sorted(glob.glob(os.path.join(cache_subdir, "frame_*.jpg")))
+            with os.scandir(cache_subdir) as it:
+                cached_files = sorted(e.path for e in it if e.name.startswith('frame_') and e.name.endswith('.jpg'))
             if len(cached_files) > 0:
                 urls = [f"/galleryout/storyboard_frame/{file_hash}/{os.path.basename(f)}" for f in cached_files]
                 return jsonify({'status': 'success', 'cached': True, 'frames': urls})
@@ -5494,10 +5840,7 @@ def get_storyboard(file_id):
         if info['type'] == 'video' and has_ffmpeg and duration > 15:
             print(f"🔍 Quick test...")
             
-            ffmpeg_name = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
-            ffmpeg_bin = os.path.join(os.path.dirname(FFPROBE_EXECUTABLE_PATH), ffmpeg_name)
-            if not os.path.exists(ffmpeg_bin): 
-                ffmpeg_bin = ffmpeg_name
+            ffmpeg_bin = get_ffmpeg_path()
             
             test_path = os.path.join(cache_subdir, "test.jpg")
             # Test at 50% - faster seek and still detects corruption
@@ -5555,10 +5898,7 @@ def get_storyboard(file_id):
             print(f"🔧 Transcoding...")
             
             try:
-                ffmpeg_name = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
-                ffmpeg_bin = os.path.join(os.path.dirname(FFPROBE_EXECUTABLE_PATH), ffmpeg_name)
-                if not os.path.exists(ffmpeg_bin): 
-                    ffmpeg_bin = ffmpeg_name
+                ffmpeg_bin = get_ffmpeg_path()
                 
                 temp_transcoded = os.path.join(cache_subdir, f"temp_proxy_{uuid.uuid4().hex}.mp4")
                 
@@ -5576,10 +5916,11 @@ def get_storyboard(file_id):
                 
                 creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
                 
+                # Output is never inspected
                 subprocess.run(
                     cmd_transcode,
-                    capture_output=True,
-                    text=True,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
                     timeout=300,
                     creationflags=creation_flags
                 )
@@ -5648,10 +5989,7 @@ def get_storyboard(file_id):
                     if fps > 0:
                         actual_frame_number = int(timestamp * fps)
                     
-                    ffmpeg_name = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
-                    ffmpeg_bin = os.path.join(os.path.dirname(FFPROBE_EXECUTABLE_PATH), ffmpeg_name)
-                    if not os.path.exists(ffmpeg_bin): 
-                        ffmpeg_bin = ffmpeg_name 
+                    ffmpeg_bin = get_ffmpeg_path()
                     
                     creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
                     
@@ -5861,7 +6199,7 @@ def serve_input_file(filename):
         # Prevent path traversal
         filename = secure_filename(filename)
         filepath = os.path.abspath(os.path.join(BASE_INPUT_PATH, filename))
-        if not filepath.startswith(os.path.abspath(BASE_INPUT_PATH)):
+        if not filepath.startswith(BASE_INPUT_PATH_ABS):
             abort(403)
         
         # For webp, frocing the correct mimetype
@@ -5880,7 +6218,7 @@ def check_metadata(file_id):
     Now includes Real Path resolution for mounted folders.
     """
     try:
-        with get_db_connection() as conn:
+        with get_read_connection() as conn:
             # Added 'path' to selection to resolve symlinks
             row = conn.execute("SELECT path, has_workflow, ai_caption, ai_last_scanned FROM files WHERE id = ?", (file_id,)).fetchone()
             
@@ -5926,9 +6264,7 @@ def stream_video(file_id):
         abort(404, description="FFmpeg/FFprobe not found on system.")
 
     # Determine ffmpeg executable path based on ffprobe location
-    ffmpeg_dir = os.path.dirname(FFPROBE_EXECUTABLE_PATH)
-    ffmpeg_name = "ffmpeg.exe" if sys.platform == "win32" else "ffmpeg"
-    ffmpeg_path = os.path.join(ffmpeg_dir, ffmpeg_name) if ffmpeg_dir else ffmpeg_name
+    ffmpeg_path = get_ffmpeg_path()
 
     # FFmpeg command for fast on-the-fly transcoding
     # -preset ultrafast: minimal CPU usage
@@ -5986,7 +6322,7 @@ def stream_video(file_id):
 def get_collections():
     user_id = str(session.get('user_id', '')).strip()
     user_role = session.get('role', 'GUEST')
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         # Fetch collections and force field types
         rows = conn.execute("SELECT * FROM collections ORDER BY name").fetchall()
         
@@ -5995,7 +6331,7 @@ def get_collections():
             c = dict(r)
             
             # Logic for Exhibition Mode
-            if IS_EXHIBITION_MODE and user_role not in ['ADMIN', 'MANAGER', 'STAFF']:
+            if IS_EXHIBITION_MODE and user_role not in PRIVILEGED_ROLES:
                 if c['type'] == 'system_flag': continue
                 
                 # Check Public flag
@@ -6014,7 +6350,7 @@ def get_collections():
                 if not is_public and str(user_id) in shared_list:
                     c['is_shared_access'] = True
             
-            if IS_EXHIBITION_MODE and user_role in ['ADMIN', 'MANAGER', 'STAFF']:
+            if IS_EXHIBITION_MODE and user_role in PRIVILEGED_ROLES:
                 # Robust Shared Users extraction
                 shared_raw = str(c.get('shared_users', '')).split(',')
                 # Remove spaces, ensure they are strings
@@ -6032,17 +6368,20 @@ def get_collections():
 def get_sidebar_state():
     """Returns the current state of folders and collections for real-time sync."""
     folders = get_dynamic_folder_config(force_refresh=True)
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         flags = conn.execute("SELECT * FROM collections WHERE type='system_flag' ORDER BY id").fetchall()
         albums = conn.execute("SELECT * FROM collections WHERE type='user_album' ORDER BY name").fetchall()
     
-    return jsonify({
+    response = jsonify({
         'folders': folders,
         'collections': {
             'flags': [dict(r) for r in flags],
             'albums': [dict(r) for r in albums]
         }
     })
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/galleryout/api/collections/rename', methods=['POST'])
 @management_api_only
@@ -6177,7 +6516,7 @@ def get_file_collections(file_id):
     query += " ORDER BY c.type DESC, c.name ASC"
     
     try:
-        with get_db_connection() as conn:
+        with get_read_connection() as conn:
             rows = conn.execute(query, (file_id,)).fetchall()
             
         return jsonify({
@@ -6342,7 +6681,7 @@ def collection_view(coll_id):
         # Standard logic: Fetch specific Collection Metadata from DB
         try:
             target_id = int(coll_id)
-            with get_db_connection() as conn:
+            with get_read_connection() as conn:
                 row = conn.execute("SELECT * FROM collections WHERE id=?", (target_id,)).fetchone()
                 if row: coll_info = dict(row)
         except ValueError:
@@ -6362,7 +6701,7 @@ def collection_view(coll_id):
             user_id = str(session.get('user_id', ''))
             user_role = session.get('role', 'GUEST')
             is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
-            is_privileged = is_local_admin or (user_role in ['ADMIN', 'MANAGER', 'STAFF'])
+            is_privileged = is_local_admin or (user_role in PRIVILEGED_ROLES)
             
             shared_list = [u.strip() for u in str(coll_info.get('shared_users', '')).split(',') if u.strip()]
             
@@ -6397,7 +6736,7 @@ def collection_view(coll_id):
             safe_uid = str(session.get('user_id', '')).replace("'", "''")
             is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
             
-            if is_local_admin or user_role in ['ADMIN', 'MANAGER', 'STAFF']:
+            if is_local_admin or user_role in PRIVILEGED_ROLES:
                 sub_query += " AND (is_public = 1 OR shared_users != '')"
             else:
                 sub_query += f" AND (is_public = 1 OR (',' || shared_users || ',') LIKE '%,{safe_uid},%')"
@@ -6477,7 +6816,7 @@ def collection_view(coll_id):
                     cond_str = f"{col_expr} {'NOT LIKE' if is_not else 'LIKE'} ?"
                     param_val = f"% {clean_s} %"
                 else:
-                    cond_str = f"f.workflow_prompt {'NOT LIKE' if is_not else 'LIKE'} ?"
+                    cond_str = prompt_like_condition('f.', is_not)
                     param_val = f"%{s}%"
                     
                 if is_not:
@@ -6582,7 +6921,7 @@ def collection_view(coll_id):
             try:
                 # FIX: Ensure a database connection is explicitly opened to fetch the admin ID.
                 # Solves the missing ID bug in "All Collections" mode where 'conn' is not yet defined.
-                with get_db_connection() as temp_conn:
+                with get_read_connection() as temp_conn:
                     admin_id = temp_conn.execute("SELECT user_id FROM users WHERE username = 'admin'").fetchone()
                     if admin_id and str(admin_id[0]) not in expanded_raters:
                         expanded_raters.append(str(admin_id[0]))
@@ -6647,14 +6986,14 @@ def collection_view(coll_id):
     total_db_files = 0
     total_folder_files = 0 
 
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         # Calculate total files in this view (without search/filters)
         if is_all_mode:
             count_subquery = "SELECT id FROM collections WHERE type='user_album'"
             if IS_EXHIBITION_MODE: 
                 user_role = session.get('role', 'GUEST')
                 safe_uid = str(session.get('user_id', '')).replace("'", "''")
-                if user_role in['ADMIN', 'MANAGER', 'STAFF']:
+                if user_role in PRIVILEGED_ROLES:
                     count_subquery += " AND (is_public = 1 OR shared_users != '')"
                 else:
                     count_subquery += f" AND (is_public = 1 OR (',' || shared_users || ',') LIKE '%,{safe_uid},%')"
@@ -6680,13 +7019,13 @@ def collection_view(coll_id):
         # Allow Local Admin (no force login) to see all comments during sort
         is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
         
-        if is_local_admin or user_role in ['ADMIN', 'MANAGER', 'STAFF']:
+        if is_local_admin or user_role in PRIVILEGED_ROLES:
             comment_sub_filter = ""
         else:
             comment_sub_filter = f" AND (target_audience = 'public' OR target_audience = 'user:{safe_uuid}' OR client_uuid = '{safe_uuid}')"
 
         query = f"""
-            SELECT DISTINCT f.*,
+            SELECT DISTINCT {FILES_LIST_COLUMNS},
             (SELECT c.color FROM collections c JOIN collection_files cf2 ON c.id = cf2.collection_id WHERE cf2.file_id = f.id AND c.type = 'system_flag' LIMIT 1) as status_color,
             (SELECT AVG(rating) FROM file_ratings WHERE file_id = f.id) as avg_rating,
             (SELECT COUNT(*) FROM file_ratings WHERE file_id = f.id) as vote_count,
@@ -6702,9 +7041,7 @@ def collection_view(coll_id):
         rows = conn.execute(query, params).fetchall()
         
         for r in rows:
-            d = dict(r)
-            if 'ai_embedding' in d: del d['ai_embedding']
-            final_files.append(d)
+            final_files.append(dict(r))
             
         try:
             users_rows = conn.execute("SELECT user_id, full_name FROM users WHERE is_active=1 AND username != 'admin'").fetchall()
@@ -6765,20 +7102,13 @@ def collection_view(coll_id):
         fname = f['name']
         if '.' in fname: extensions.add(fname.split('.')[-1].lower())
         if not prefix_limit_reached and '_' in fname:
-            pfx = fname.split('_')[0]
+            pfx = fname.partition('_')[0]
             if pfx:
                 prefixes.add(pfx)
                 if len(prefixes) > MAX_PREFIX_DROPDOWN_ITEMS:
                     prefix_limit_reached = True
                     prefixes.clear()
 
-    try:
-        with get_db_connection() as conn_opts:
-            users_rows = conn_opts.execute("SELECT user_id, full_name FROM users WHERE is_active=1 AND username != 'admin'").fetchall()
-            available_raters = [{'id': str(r['user_id']), 'name': r['full_name']} for r in users_rows]
-    except:
-        available_raters =[]
-    available_raters.insert(0, {'id': 'admin', 'name': 'System Admin'})
     template_name = 'exhibition.html' if IS_EXHIBITION_MODE else 'index.html'
 
     return render_template(template_name, 
@@ -6818,7 +7148,7 @@ def get_rating_details():
         return jsonify({'status': 'error', 'message': 'Missing file ID'}), 400
         
     try:
-        with get_db_connection() as conn:
+        with get_read_connection() as conn:
             # Join ratings with users to get real names
             query = '''
                 SELECT r.rating, r.client_uuid, u.full_name 
@@ -6964,11 +7294,11 @@ def exhibition_get_comments():
     if not file_id: 
         return jsonify({'status': 'error', 'message': 'File ID missing'}), 400
     
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         # --- FIX: LOCAL ADMIN EQUIVALENCE ---
         # If FORCE_LOGIN is False and we are in the main interface, the user is implicitly Admin
         is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
-        is_privileged = is_local_admin or (current_role in ['ADMIN', 'MANAGER', 'STAFF'])
+        is_privileged = is_local_admin or (current_role in PRIVILEGED_ROLES)
         
         if is_privileged:
             # Admins, Managers, and Staff see EVERYTHING
@@ -7024,12 +7354,12 @@ def exhibition_get_comments():
 def get_users_simple_list():
     # --- FIX: LOCAL ADMIN EQUIVALENCE ---
     is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
-    if not is_local_admin and session.get('role') not in ['ADMIN', 'MANAGER', 'STAFF']:
+    if not is_local_admin and session.get('role') not in PRIVILEGED_ROLES:
         return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
         
     exclude_staff = request.args.get('exclude_staff', 'false').lower() == 'true'
     try:
-        with get_db_connection() as conn:
+        with get_read_connection() as conn:
             query = "SELECT user_id, full_name, username FROM users WHERE is_active = 1 AND username != 'admin'"
             if exclude_staff:
                 query += " AND role NOT IN ('ADMIN', 'MANAGER', 'STAFF')"
@@ -7058,7 +7388,7 @@ def exhibition_post_comment():
     
     # --- FIX: LOCAL ADMIN EQUIVALENCE ---
     is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
-    is_privileged = is_local_admin or (role in ['ADMIN', 'MANAGER', 'STAFF'])
+    is_privileged = is_local_admin or (role in PRIVILEGED_ROLES)
     
     # Security: Non-privileged users can ONLY post 'public' or 'internal' (Staff Only).
     # They cannot DM specific users (e.g., 'user:123').
@@ -7177,7 +7507,7 @@ def is_effectively_blind():
     # Check if user is privileged
     role = session.get('role', 'GUEST')
     is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
-    if is_local_admin or role in ['ADMIN', 'MANAGER', 'STAFF']:
+    if is_local_admin or role in PRIVILEGED_ROLES:
         # If they toggled the override, disable blind mode
         if session.get('override_blind', False):
             return False
@@ -7192,7 +7522,7 @@ def toggle_my_ratings():
 def toggle_blind_override():
     role = session.get('role', 'GUEST')
     is_local_admin = (not FORCE_LOGIN and not IS_EXHIBITION_MODE)
-    if not is_local_admin and role not in ['ADMIN', 'MANAGER', 'STAFF']:
+    if not is_local_admin and role not in PRIVILEGED_ROLES:
         return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
     
     session['override_blind'] = not session.get('override_blind', False)
@@ -7239,7 +7569,9 @@ REMOTE_VERSION = None  # New global variable
 def check_for_updates():
     """Checks the GitHub repo for a newer version without external libs."""
     global UPDATE_AVAILABLE, REMOTE_VERSION
-    print("Checking for updates...", end=" ", flush=True)
+    # Runs on a background thread: build the result first and print it as one line
+    # so it does not interleave with the rest of the startup output.
+    status = "Could not parse remote version."
     try:
         # Timeout (3s) not blocking start if no internet connection
         with urllib.request.urlopen(GITHUB_RAW_URL, timeout=3) as response:
@@ -7279,14 +7611,13 @@ def check_for_updates():
                 if is_update_available:
                     UPDATE_AVAILABLE = True
                     REMOTE_VERSION = remote_version_str # Store the version string
-                    print(f"\n{Colors.YELLOW}{Colors.BOLD}NOTICE: A new version ({remote_version_str}) is available!{Colors.RESET}")
+                    status = f"\n{Colors.YELLOW}{Colors.BOLD}NOTICE: A new version ({remote_version_str}) is available!{Colors.RESET}"
                 else:
-                    print("You are up to date.")
-            else:
-                print("Could not parse remote version.")
+                    status = "You are up to date."
                 
     except Exception:
-        print("Skipped (Offline or GitHub unreachable).")
+        status = "Skipped (Offline or GitHub unreachable)."
+    print(f"Checking for updates... {status}", flush=True)
         
 # --- STARTUP CHECKS AND MAIN ENTRY POINT ---
 def show_config_error_and_exit(path):
@@ -7375,11 +7706,32 @@ app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('COMFYUI_MAX_UPLOAD_MB', 1
 
 
 # Experimental Remix API Module
-import json
-import os
+
+# --- IMPORTED WORKFLOW TEMPLATE CACHE ---
+# Parsed templates keyed by path. An entry is reused while the file's (mtime_ns, size) is unchanged,
+# so the library list and remix endpoints don't re-read and re-parse every JSON on each request.
+# Cached objects are shared: callers must treat them as read-only.
+_workflow_template_cache = {}
+# Serialized body of the template library listing, keyed by the (name, mtime_ns, size) snapshot of the folder
+_workflow_list_cache = {'key': None, 'body': None}
+
+def load_workflow_template(path):
+    """Returns the parsed JSON of a template file, re-reading it only when it changed on disk."""
+    st = os.stat(path)
+    cached = _workflow_template_cache.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    _workflow_template_cache[path] = (st.st_mtime_ns, st.st_size, data)
+    return data
 
 
 def _register_remix_routes_inline():
+    # Idempotent: a second call (re-import, reloader) must not re-add the same endpoints,
+    # which Flask would reject with an 'overwriting an existing endpoint' AssertionError.
+    if 'api_remix_list_workflows' in app.view_functions:
+        return
     
     def parse_workflow(raw_json, wf_type, raw_ui_json=None):
         wf_data = json.loads(raw_json)
@@ -7601,26 +7953,35 @@ def _register_remix_routes_inline():
         try:
             if not os.path.exists(IMPORTED_WORKFLOWS_DIR):
                 os.makedirs(IMPORTED_WORKFLOWS_DIR, exist_ok=True)
+            entries = []
+            with os.scandir(IMPORTED_WORKFLOWS_DIR) as it:
+                for entry in it:
+                    if entry.name.lower().endswith('.json') and entry.is_file():
+                        entries.append((entry.name, entry.path, entry.stat()))
+            
+            snapshot = tuple((name, st.st_mtime_ns, st.st_size) for name, _, st in entries)
+            if _workflow_list_cache['key'] == snapshot:
+                return Response(_workflow_list_cache['body'], mimetype='application/json')
+            
             files = []
-            for f in os.listdir(IMPORTED_WORKFLOWS_DIR):
-                if not f.lower().endswith('.json'): continue
-                path = os.path.join(IMPORTED_WORKFLOWS_DIR, f)
-                if os.path.isfile(path):
-                    mtime = os.path.getmtime(path)
-                    has_app = False
-                    has_custom = False
-                    source_file_id = None
-                    try:
-                        with open(path, 'r', encoding='utf-8') as jf:
-                            data = json.load(jf)
-                            ui_data = data.get('ui', {})
-                            extra = ui_data.get('extra', {})
-                            if 'linearData' in extra or 'app' in extra or 'app' in ui_data: has_app = True
-                            source_file_id = data.get('sg_meta', {}).get('source_file_id')
-                            has_custom = bool(data.get('sg_meta', {}).get('custom_app'))
-                    except: pass
-                    files.append({'name': f, 'mtime': mtime, 'has_app_mode': has_app, 'has_custom_mode': has_custom, 'source_file_id': source_file_id})
-            return jsonify({'status': 'success', 'workflows': files})
+            for f, path, st in entries:
+                has_app = False
+                has_custom = False
+                source_file_id = None
+                try:
+                    data = load_workflow_template(path)
+                    ui_data = data.get('ui', {})
+                    extra = ui_data.get('extra', {})
+                    if 'linearData' in extra or 'app' in extra or 'app' in ui_data: has_app = True
+                    source_file_id = data.get('sg_meta', {}).get('source_file_id')
+                    has_custom = bool(data.get('sg_meta', {}).get('custom_app'))
+                except: pass
+                files.append({'name': f, 'mtime': st.st_mtime, 'has_app_mode': has_app, 'has_custom_mode': has_custom, 'source_file_id': source_file_id})
+            # jsonify() rather than app.json, which only exists from Flask 2.2
+            body = jsonify({'status': 'success', 'workflows': files}).get_data()
+            _workflow_list_cache['key'] = snapshot
+            _workflow_list_cache['body'] = body
+            return Response(body, mimetype='application/json')
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -7652,11 +8013,10 @@ def _register_remix_routes_inline():
                 # PATCH: Read workflow data directly from the existing template instead of extracting from media
                 tpl_path = os.path.join(IMPORTED_WORKFLOWS_DIR, secure_filename(workflow_file))
                 if os.path.exists(tpl_path):
-                    with open(tpl_path, 'r', encoding='utf-8') as f:
-                        tpl_data = json.load(f)
-                        raw_api = json.dumps(tpl_data.get('api', {}))
-                        raw_ui = json.dumps(tpl_data.get('ui', {}))
-                        source_file_id = tpl_data.get('sg_meta', {}).get('source_file_id', file_id)
+                    tpl_data = load_workflow_template(tpl_path)
+                    raw_api = json.dumps(tpl_data.get('api', {}))
+                    raw_ui = json.dumps(tpl_data.get('ui', {}))
+                    source_file_id = tpl_data.get('sg_meta', {}).get('source_file_id', file_id)
             else:
                 # Standard extraction from media file
                 if not file_id: return jsonify({'status': 'error', 'message': 'Missing file ID'}), 400
@@ -7734,8 +8094,29 @@ def _register_remix_routes_inline():
             }
             
             os.makedirs(IMPORTED_WORKFLOWS_DIR, exist_ok=True)
-            with open(os.path.join(IMPORTED_WORKFLOWS_DIR, safe_name), 'w', encoding='utf-8') as f:
-                json.dump(template_data, f)
+            # Serialize up front, write once to a temp file, then atomically swap it in
+            # (a crash mid-save can no longer leave a truncated template behind)
+            dest_path = os.path.join(IMPORTED_WORKFLOWS_DIR, safe_name)
+            tmp_path = dest_path + '.tmp'
+            payload = None
+            # orjson silently writes NaN/Infinity as null, so the fast path is only taken when the
+            # source JSON cannot contain them (a false positive just means stdlib json)
+            if ORJSON_AVAILABLE and all(isinstance(raw, str) and 'NaN' not in raw and 'Infinity' not in raw for raw in (raw_api, raw_ui)):
+                try:
+                    payload = orjson.dumps(template_data)
+                except orjson.JSONEncodeError:
+                    pass  # e.g. integers wider than 64 bits
+            if payload is None:
+                payload = json.dumps(template_data, ensure_ascii=False).encode('utf-8')
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, dest_path)
+            except OSError:
+                # Do not leave a half-written .tmp next to the templates
+                try: os.remove(tmp_path)
+                except OSError: pass
+                raise
                 
             return jsonify({'status': 'success', 'message': 'Template saved!'})
         except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -7755,6 +8136,7 @@ def _register_remix_routes_inline():
             if not os.path.exists(old_path): return jsonify({'status': 'error', 'message': 'Original template not found'}), 404
             if os.path.exists(new_path): return jsonify({'status': 'error', 'message': 'A template with this name already exists'}), 400
             os.rename(old_path, new_path)
+            _workflow_template_cache.pop(old_path, None)
             return jsonify({'status': 'success'})
         except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -7767,94 +8149,34 @@ def _register_remix_routes_inline():
             path = os.path.join(IMPORTED_WORKFLOWS_DIR, secure_filename(filename))
             if os.path.exists(path):
                 os.remove(path)
+                _workflow_template_cache.pop(path, None)
                 return jsonify({'status': 'success'})
             return jsonify({'status': 'error', 'message': 'Not found'}), 404
         except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
-    def _convert_ui_to_api(ui_data, object_info):
-        nodes = ui_data.get('nodes', [])
-        links = ui_data.get('links', [])
-        link_map = {}
-        for lnk in links:
-            if len(lnk) >= 4: link_map[lnk[0]] = [str(lnk[1]), lnk[2]]
-        api = {}
-        for node in nodes:
-            node_id = str(node.get('id'))
-            node_type = node.get('type', '')
-            if node_type in ('Note', 'PrimitiveNode', 'Reroute'): continue
-            
-            node_inputs_connected = node.get('inputs', [])
-            widgets_values = node.get('widgets_values', [])
-            inputs = {}
-            linked_names = set()
-            for inp in node_inputs_connected:
-                link_id = inp.get('link')
-                if link_id is not None and link_id in link_map:
-                    inputs[inp['name']] = link_map[link_id]
-                    linked_names.add(inp['name'])
-                    
-            if isinstance(widgets_values, dict):
-                for k, v in widgets_values.items():
-                    if isinstance(v, (str, int, float, bool)): inputs[k] = v
-            else:
-                param_names = NODE_PARAM_NAMES.get(node_type, [])
-                if param_names:
-                    wv_list = list(widgets_values)
-                    for i, w_val in enumerate(wv_list):
-                        wname = param_names[i] if i < len(param_names) else f"widget_{i}"
-                        if wname not in linked_names: inputs[wname] = w_val
-                elif node_type in object_info:
-                    node_def = object_info[node_type]
-                    required = node_def.get('input', {}).get('required', {})
-                    optional = node_def.get('input', {}).get('optional', {})
-                    hidden  = node_def.get('input', {}).get('hidden', {})
-                    all_inputs = list(required.items()) + list(optional.items())
-                    hidden_names = set(hidden.keys())
-                    widget_names = []
-                    for inp_name, inp_def in all_inputs:
-                        if inp_name in linked_names: continue
-                        inp_type = inp_def[0] if (isinstance(inp_def, (list, tuple)) and inp_def) else inp_def
-                        is_connection = isinstance(inp_type, str) and inp_type == inp_type.upper() and inp_type not in ('INT', 'FLOAT', 'STRING', 'BOOLEAN')
-                        if not is_connection: widget_names.append((inp_name, inp_name in hidden_names))
-                    for inp_name in hidden_names:
-                        if inp_name not in linked_names and not any(n == inp_name for n, _ in widget_names): widget_names.append((inp_name, True))
-                    wv_list = list(widgets_values)
-                    for i, (wname, is_hidden) in enumerate(widget_names):
-                        if i < len(wv_list) and not is_hidden: inputs[wname] = wv_list[i]
-                else:
-                    wv_list = list(widgets_values)
-                    for i, w_val in enumerate(wv_list):
-                        wname = f"widget_{i}"
-                        if wname not in linked_names: inputs[wname] = w_val
-
-            title = node.get('title') or node_type
-            api[node_id] = {'class_type': node_type, '_meta': {'title': title}, 'inputs': inputs}
-        return api
-
     def _get_unified_workflow(file_id, workflow_override, companion_override, target_comfy_url=COMFYUI_SERVER_URL):
         if workflow_override:
             override_path = os.path.join(IMPORTED_WORKFLOWS_DIR, secure_filename(workflow_override))
             if os.path.isfile(override_path):
-                with open(override_path, 'r', encoding='utf-8') as wf_f:
-                    tpl_data = json.load(wf_f)
-                    raw_api = json.dumps(tpl_data.get('api', {}))
-                    raw_ui  = json.dumps(tpl_data.get('ui', {}))
-                    
-                    # Convert UI to API if the template was an old JSON lacking API data
-                    if raw_ui and raw_api == "{}":
+                tpl_data = load_workflow_template(override_path)
+                raw_api = json.dumps(tpl_data.get('api', {}))
+                raw_ui  = json.dumps(tpl_data.get('ui', {}))
+                
+                # Convert UI to API if the template was an old JSON lacking API data
+                if raw_ui and raw_api == "{}":
+                    try:
+                        ui_data = json.loads(raw_ui)
+                        object_info = {}
                         try:
-                            ui_data = json.loads(raw_ui)
-                            object_info = {}
-                            try:
-                                info_req = urllib.request.Request(f"{target_comfy_url.rstrip('/')}/object_info", headers={'Content-Type': 'application/json'})
-                                with urllib.request.urlopen(info_req, timeout=3) as r: object_info = json.loads(r.read().decode('utf-8'))
-                            except Exception: pass
-                            converted_api = _convert_ui_to_api(ui_data, object_info)
-                            if converted_api: raw_api = json.dumps(converted_api)
+                            info_req = urllib.request.Request(f"{target_comfy_url.rstrip('/')}/object_info", headers={'Content-Type': 'application/json'})
+                            with urllib.request.urlopen(info_req, timeout=3) as r: object_info = json.loads(r.read().decode('utf-8'))
                         except Exception: pass
-                        
-                    sg_meta = tpl_data.get('sg_meta', {})
-                    return raw_api, raw_ui, sg_meta, None
+                        converted_api = _convert_ui_to_api(ui_data, object_info)
+                        if converted_api: raw_api = json.dumps(converted_api)
+                    except Exception: pass
+                    
+                sg_meta = tpl_data.get('sg_meta', {})
+                return raw_api, raw_ui, sg_meta, None
             return None, None, {}, "Template file not found."
             
         target_path = companion_override if companion_override and os.path.isfile(companion_override) else get_file_info_from_db(file_id)['path']
@@ -8299,7 +8621,8 @@ if __name__ == '__main__':
         print(f"{Colors.YELLOW}{Colors.BOLD}*** SECURE TEAM MODE ACTIVE (--force-login) ***{Colors.RESET}")
         print(f"Index view is protected. Users must log in to view or manage files.")
     
-    check_for_updates()
+    # The update check can wait up to 3s on the network
+    threading.Thread(target=check_for_updates, daemon=True).start()
     print_configuration()
 
     # --- CHECK: CRITICAL OUTPUT PATH CHECK (Blocking) ---